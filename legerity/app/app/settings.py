@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Our apps
     'helpers.apps.HelpersConfig',
     *LOCAL_APPS,
@@ -63,9 +64,11 @@ INSTALLED_APPS = [
     'corsheaders',
     'tinymce',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
+    'helpers.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
 
@@ -97,6 +100,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'app.wsgi.application'
+ASGI_APPLICATION = 'app.asgi.application'
+
+# scripts/run.sh serves the app with uWSGI ("wsgi") or uvicorn ("asgi"); under ASGI
+# the catalog and review lists are routed to the native async views
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASYNC_CATALOG_VIEWS = bool(int(os.environ.get('ASYNC_CATALOG_VIEWS', SERVER_MODE == 'asgi')))
 
 
 # Database
@@ -113,6 +122,78 @@ DATABASES = {
 }
 
 
+# Text search configuration used for Product.search_vector
+SEARCH_CONFIG = os.environ.get('SEARCH_CONFIG', 'simple')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The catalog alias holds versioned API responses and best-seller boards (see
+# shopping/cache.py). With more than one process it must be shared, e.g.
+# django.core.cache.backends.filebased.FileBasedCache on a volume every container
+# mounts; CATALOG_CACHE_REQUIRE_SHARED=1 (set in the image) refuses local memory.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': os.environ.get('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+CATALOG_CACHE_REQUIRE_SHARED = bool(int(os.environ.get('CATALOG_CACHE_REQUIRE_SHARED', 0)))
+
+# Size and TTL in seconds of the per-process LRU in front of the catalog cache
+CATALOG_CACHE_LOCAL_ENTRIES = int(os.environ.get('CATALOG_CACHE_LOCAL_ENTRIES', 256))
+CATALOG_CACHE_LOCAL_TTL = int(os.environ.get('CATALOG_CACHE_LOCAL_TTL', 30))
+
+
+# Rows fetched per server-side cursor round trip and emitted per chunk by ?stream=true lists
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+
+# Length of the plain-text excerpts stored next to rich-text fields
+HTML_EXCERPT_LENGTH = min(int(os.environ.get('HTML_EXCERPT_LENGTH', 200)), 255)
+
+# Delta rows per product that checkouts spread sales_number increments over
+SALES_COUNTER_SHARDS = int(os.environ.get('SALES_COUNTER_SHARDS', 8))
+
+# Background jobs (helpers/jobs.py): attempts per job and retry delays in seconds
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_RETRY_BACKOFF = int(os.environ.get('JOBS_RETRY_BACKOFF', 10))
+JOBS_RETRY_BACKOFF_MAX = int(os.environ.get('JOBS_RETRY_BACKOFF_MAX', 3600))
+# Seconds between runs of the periodic maintenance jobs
+RELEASE_RESERVATIONS_INTERVAL = int(os.environ.get('RELEASE_RESERVATIONS_INTERVAL', 60))
+FOLD_SALES_COUNTERS_INTERVAL = int(os.environ.get('FOLD_SALES_COUNTERS_INTERVAL', 60))
+
+# Share of requests (0 to 1) whose queries are counted and timed by
+# helpers.middleware.QueryInstrumentationMiddleware; 0 turns it off entirely
+QUERY_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('QUERY_INSTRUMENTATION_SAMPLE_RATE', 0))
+# A SQL shape repeated more often than this within one request is logged as a likely N+1
+QUERY_INSTRUMENTATION_REPEAT_THRESHOLD = int(os.environ.get('QUERY_INSTRUMENTATION_REPEAT_THRESHOLD', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'helpers.queries': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Number of products kept on each best-seller board
+BESTSELLERS_SIZE = int(os.environ.get('BESTSELLERS_SIZE', 50))
+# Seconds before a cached best-seller board is rebuilt from the database
+BESTSELLERS_CACHE_TIMEOUT = int(os.environ.get('BESTSELLERS_CACHE_TIMEOUT', 600))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -154,6 +235,12 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Widths of the resized copies made for every product image, and the size of the
+# process pool that generate_image_derivatives backfills them with (admin uploads
+# are resized by the job worker)
+PRODUCT_IMAGE_WIDTHS = (320, 640, 1024)
+PRODUCT_IMAGE_WORKERS = int(os.environ.get('PRODUCT_IMAGE_WORKERS', 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -163,11 +250,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'customer.authentication.CachedTokenAuthentication',
+        'customer.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Per-process cache of authenticated users (customer/authentication.py): size and
+# seconds before a change made in another process is picked up
+AUTH_USER_CACHE_ENTRIES = int(os.environ.get('AUTH_USER_CACHE_ENTRIES', 1024))
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+
+# Bloom filter in front of refresh-token blacklist checks (customer/blacklist.py):
+# seconds between rebuilds and target false-positive rate
+JWT_BLACKLIST_FILTER_REFRESH = int(os.environ.get('JWT_BLACKLIST_FILTER_REFRESH', 30))
+JWT_BLACKLIST_FILTER_ERROR_RATE = float(os.environ.get('JWT_BLACKLIST_FILTER_ERROR_RATE', 0.001))
+# Seconds between runs of the customer.prune_token_blacklist job
+PRUNE_TOKEN_BLACKLIST_INTERVAL = int(os.environ.get('PRUNE_TOKEN_BLACKLIST_INTERVAL', 3600))
+
+# Build request.user from JWT claims, without a query, on views that only need the id
+JWT_STATELESS_AUTH = bool(int(os.environ.get('JWT_STATELESS_AUTH', 0)))
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Something',
     'DESCRIPTION': 'Something APIs',
@@ -178,6 +280,9 @@ SPECTACULAR_SETTINGS = {
 # CORS Config
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Stock reserved by cart lines is returned to the product after this long
+STOCK_RESERVATION_TTL = timedelta(minutes=int(os.environ.get("STOCK_RESERVATION_MINUTES", 15)))
+
 # Custom User Model
 AUTH_USER_MODEL = "customer.User"
 
@@ -216,7 +321,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "customer.api.serializers.FilteredTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
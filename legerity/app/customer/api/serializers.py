@@ -2,7 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
+from customer.blacklist import FilteredRefreshToken
 User = get_user_model()
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -50,4 +52,8 @@ class LoginSerializer(serializers.Serializer):
                 'email': user.email,
                 'fullname': user.fullname
             }
-        }
\ No newline at end of file
+        }
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
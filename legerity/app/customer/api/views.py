@@ -11,7 +11,9 @@ class CustomTokenRefreshView(TokenRefreshView):
         response= super().post(request, *args, **kwargs)
 
         if response.status_code==200 and "access" in response.data:
-            return Response({"access": response.data["access"]}, status=status.HTTP_200_ok)
+            # With rotation on, the old refresh token is now blacklisted; pass on the new one.
+            data = {key: response.data[key] for key in ("access", "refresh") if key in response.data}
+            return Response(data, status=status.HTTP_200_OK)
         
         return response
 
@@ -0,0 +1,111 @@
+'''
+Authentication classes that resolve the request user from a per-process cache.
+
+Token and JWT authentication normally cost one query per request (the token join or
+the ``User`` fetch). Here resolved users are kept in a bounded LRU keyed by user id,
+and token keys map to user ids, for ``AUTH_USER_CACHE_TTL`` seconds. Saving or deleting
+a ``User`` or ``Token`` (which includes password changes) evicts the entry in the
+process that made the change, see ``customer.signals``. Other processes notice within
+the TTL, and so do changes made with ``QuerySet.update()``.
+'''
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from helpers.cache import LRUCache
+
+user_cache = LRUCache(max_entries=settings.AUTH_USER_CACHE_ENTRIES, ttl=settings.AUTH_USER_CACHE_TTL)
+
+
+def user_key(user_id):
+    return ('user', str(user_id))
+
+
+def token_key(key):
+    return ('token', key)
+
+
+def get_cached_user(user_id):
+    ''' Return a private copy of the user with ``user_id``; raises ``DoesNotExist``. '''
+    user = user_cache.get(user_key(user_id))
+    if user is None:
+        user = get_user_model().objects.get(pk=user_id)
+        user_cache.set(user_key(user_id), user)
+    return copy.copy(user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    ''' ``TokenAuthentication`` without the token query once the key has been seen. '''
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user_id = user_cache.get(token_key(key))
+        if user_id is None:
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user_id = token.user_id
+            user_cache.set(token_key(key), user_id)
+            user_cache.set(user_key(user_id), token.user)
+        try:
+            user = get_cached_user(user_id)
+        except get_user_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        token = model(key=key, user_id=user_id)
+        token.user = user
+        return (user, token)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    ''' ``JWTAuthentication`` that reads the user through the user cache. '''
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        try:
+            user = get_cached_user(user_id)
+        except self.user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise exceptions.AuthenticationFailed(
+                    _("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+class UserIdJWTAuthentication(CachedJWTAuthentication):
+    ''' JWT authentication for views that only read ``request.user.id``.
+
+    With ``JWT_STATELESS_AUTH`` on, the user is a ``TokenUser`` built from the token
+    claims and the database is never asked. Deactivating a user then only takes effect
+    when their access token expires.
+    '''
+
+    def get_user(self, validated_token):
+        if settings.JWT_STATELESS_AUTH:
+            return JWTStatelessUserAuthentication.get_user(self, validated_token)
+        return super().get_user(validated_token)
+
+
+USER_ID_AUTHENTICATION_CLASSES = [CachedTokenAuthentication, UserIdJWTAuthentication]
@@ -0,0 +1,99 @@
+'''
+In-process pre-filter for refresh-token blacklist checks.
+
+Every refresh verifies that the presented token is not blacklisted. Most tokens never
+are, so a bloom filter over the jtis of unexpired blacklisted tokens answers those
+checks without a query. Only a "maybe" from the filter goes to the database.
+
+The filter is rebuilt from the database every ``JWT_BLACKLIST_FILTER_REFRESH`` seconds.
+Tokens blacklisted in this process are added to it immediately (see
+``customer.signals``). A token blacklisted by another process can still pass here
+until the next rebuild, but rotation blacklists the presented token again and refuses
+it when the blacklist row already existed, so a replayed refresh token never mints a
+new pair.
+'''
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from helpers.bloom import BloomFilter
+
+
+class BlacklistFilter:
+    min_capacity = 1024
+
+    def __init__(self):
+        self.bloom = None
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            .values_list('token__jti', flat=True)
+        )
+        # Leave room for the tokens this process blacklists before the next rebuild.
+        bloom = BloomFilter(max(len(jtis) * 2, self.min_capacity), settings.JWT_BLACKLIST_FILTER_ERROR_RATE)
+        for jti in jtis:
+            bloom.add(jti)
+        self.bloom, self.built_at = bloom, time.monotonic()
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > settings.JWT_BLACKLIST_FILTER_REFRESH
+
+    def might_contain(self, jti):
+        if self.is_stale():
+            # One thread rebuilds; the others keep using the previous filter meanwhile.
+            if self._lock.acquire(blocking=self.bloom is None):
+                try:
+                    if self.is_stale():
+                        self.rebuild()
+                finally:
+                    self._lock.release()
+        return jti in self.bloom
+
+    def add(self, jti):
+        if self.bloom is not None:
+            self.bloom.add(jti)
+
+    def reset(self):
+        self.bloom = self.built_at = None
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class FilteredRefreshToken(RefreshToken):
+    ''' ``RefreshToken`` that only asks the database when the blacklist filter says "maybe". '''
+
+    def check_blacklist(self):
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        ''' Blacklist on rotation; a token that already was blacklisted is being replayed. '''
+        blacklisted, created = super().blacklist()
+        if not created:
+            raise TokenError(_('Token is blacklisted'))
+        return blacklisted, created
+
+
+def prune_expired(batch_size=1000, now=None):
+    ''' Delete one batch of expired outstanding tokens and their blacklist rows; returns the batch size. '''
+    now = now or timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now)
+            .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        OutstandingToken.objects.filter(id__in=ids).delete()
+    return len(ids)
@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from customer.blacklist import prune_expired
+from helpers.jobs import job
+
+
+@job('customer.prune_token_blacklist', every=timedelta(seconds=settings.PRUNE_TOKEN_BLACKLIST_INTERVAL))
+def prune_token_blacklist(batch_size=1000, max_batches=20):
+    ''' Delete expired refresh tokens; see ``manage.py prune_token_blacklist``. '''
+    for _ in range(max_batches):
+        if prune_expired(batch_size=batch_size) < batch_size:
+            break
@@ -0,0 +1,29 @@
+'''
+Django command to delete expired refresh tokens from the blacklist tables.
+'''
+import time
+
+from django.core.management.base import BaseCommand
+
+from customer.blacklist import prune_expired
+
+
+class Command(BaseCommand):
+    ''' Django command to prune expired outstanding and blacklisted tokens in small batches. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches to spread the load.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        total = 0
+        while True:
+            deleted = prune_expired(batch_size=options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Pruned {total} expired tokens.'))
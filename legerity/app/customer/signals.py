@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from customer.authentication import token_key, user_cache, user_key
+from customer.blacklist import blacklist_filter
+from customer.models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+def evict_user(sender, instance, **kwargs):
+    user_cache.delete(user_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Token)
+def evict_token(sender, instance, **kwargs):
+    user_cache.delete(token_key(instance.key))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_blacklist_filter(sender, instance, created, **kwargs):
+    if created:
+        blacklist_filter.add(instance.token.jti)
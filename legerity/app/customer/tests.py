@@ -1,8 +1,19 @@
 from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
 from django.urls import reverse
 from rest_framework import status
 from customer.models import User
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from customer.blacklist import blacklist_filter
+from helpers.bloom import BloomFilter
+from django.core.management import call_command
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
 
 # Create your tests here.
 
@@ -63,4 +74,88 @@ class LoginViewTest(APITestCase):
         }
         response = self.client.post(self.login_url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('non_field_errors', response.data)
\ No newline at end of file
+        self.assertIn('non_field_errors', response.data)
+
+
+class CachedAuthenticationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='cache@example.com', password='test123')
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('orders')
+
+    def test_token_user_is_cached_until_it_changes(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.client.get(self.url)
+        with self.assertNumQueries(1):  # orders only
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        self.user.save()
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_jwt_user_is_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+        self.user.set_password('changed')
+        self.user.save()
+        with self.assertNumQueries(2):  # the user is fetched again
+            self.client.get(self.url)
+
+    def test_stateless_jwt(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        with self.settings(JWT_STATELESS_AUTH=True), self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+
+class TokenRefreshTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='refresh@example.com', password='test123')
+        self.url = reverse('token-refresh')
+        blacklist_filter.reset()
+
+    def test_rotated_token_is_rejected(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        response = self.client.post(self.url, {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        self.assertIn('refresh', response.data)
+
+        response = self.client.post(self.url, {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_replay_before_filter_rebuild_is_rejected(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        blacklist_filter.might_contain('warm-up')
+        self.assertEqual(self.client.post(self.url, {'refresh': refresh}).status_code, status.HTTP_200_OK)
+        # A worker whose filter was built before the rotation does not know the jti yet.
+        blacklist_filter.bloom = BloomFilter(blacklist_filter.min_capacity, 0.01)
+
+        response = self.client.post(self.url, {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+    def test_unlisted_token_skips_blacklist_query(self):
+        refresh = RefreshToken.for_user(self.user)
+        blacklist_filter.might_contain('warm-up')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {'refresh': str(refresh)})
+        # Rotation still blacklists the token, but nothing looks it up by jti first.
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT 1 AS "a" FROM "token_blacklist_blacklistedtoken"')])
+
+    def test_prune_expired_tokens(self):
+        RefreshToken.for_user(self.user).blacklist()
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        RefreshToken.for_user(self.user)
+
+        call_command('prune_token_blacklist', batch_size=1, stdout=StringIO())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertFalse(BlacklistedToken.objects.exists())
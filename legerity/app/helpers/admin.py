@@ -1,3 +1,16 @@
 from django.contrib import admin
-
+from helpers.models import Job
+from helpers.paginator import EstimatedCountPaginator
 # Register your models here.
+
+class LargeTableAdmin(admin.ModelAdmin):
+    ''' Changelist settings for tables with millions of rows: estimated totals and no second full count. '''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'created_at')
+    list_filter = ('status', 'name')
+
+
+admin.site.register(Job, JobAdmin)
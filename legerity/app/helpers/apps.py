@@ -1,6 +1,10 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class HelpersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'helpers'
+
+    def ready(self):
+        autodiscover_modules('jobs')
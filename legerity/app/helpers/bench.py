@@ -0,0 +1,383 @@
+'''
+Endpoint latency benchmark behind ``manage.py bench``.
+
+``seed`` fills an empty database with a synthetic catalog, staff users and order
+history. ``run`` drives every route of ``shopping.api.urls`` and ``customer.api.urls``
+(see ``ROUTES``) through the Django test client from ``concurrency`` threads, once
+anonymously and once with each thread's user signed in with a JWT. Every thread warms
+up before the clock starts, so connections and the catalog cache are primed and the
+figures describe steady state. Each request is timed and its queries are counted with
+``helpers.middleware.QueryRecorder``. With ``trace_memory`` tracemalloc also records
+the peak allocation of each scenario, which slows every request down by a similar
+factor, so only compare reports taken with the same setting. ``compare`` lists the
+regressions of a report against a baseline report. ``isolated_caches`` keeps a run
+away from the configured caches, which other processes share.
+'''
+import math
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from customer.models import User
+from helpers.middleware import QueryRecorder
+from shopping import leaderboard, rollups
+from shopping.cache import catalog_cache
+from shopping.models import Cart, Category, Order, OrderProduct, Product, Review
+from shopping.search import refresh_id_range
+from shopping.stock import add_to_cart
+
+PASSWORD = 'bench-password'
+WORDS = [
+    'shoes', 'boots', 'jacket', 'shirt', 'leather', 'cotton', 'wool', 'summer',
+    'winter', 'running', 'classic', 'black', 'white', 'blue', 'sport', 'travel',
+]
+SEARCH_TERM = 'leather boots'
+URLCONFS = ('customer.api.urls', 'shopping.api.urls')
+AUTH_MODES = ('anonymous', 'user')
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def seed(categories=10, products=1000, reviews=100, users=20, orders=200, lines_per_order=3, seed=0):
+    ''' Create the dataset in bulk and return the users, all of them staff. '''
+    rng = random.Random(seed)
+    category_objs = Category.objects.bulk_create([
+        Category(title=f'{WORDS[i % len(WORDS)]} {i}') for i in range(categories)
+    ])
+
+    product_objs = []
+    for _ in range(products):
+        product = Product(
+            category=rng.choice(category_objs),
+            info=f'<p>{" ".join(rng.sample(WORDS, 5))}</p>',
+            price=Decimal(rng.randint(100, 50000)) / 100,
+            stock=10 ** 6,
+            sales_number=rng.randint(0, 1000),
+        )
+        product.render_info()
+        product_objs.append(product)
+    product_objs = Product.objects.bulk_create(product_objs, batch_size=1000)
+    if product_objs:
+        refresh_id_range(product_objs[0].id - 1, product_objs[-1].id)
+
+    review_objs = []
+    for i in range(reviews):
+        review = Review(fullname=f'Reviewer {i}', comment=f'<p>{" ".join(rng.sample(WORDS, 8))}</p>')
+        review.render_comment()
+        review_objs.append(review)
+    Review.objects.bulk_create(review_objs, batch_size=1000)
+
+    password = make_password(PASSWORD)
+    run = uuid.uuid4().hex[:8]
+    user_objs = User.objects.bulk_create([
+        User(email=f'bench{i}-{run}@example.com', fullname=f'Bench {i}', password=password, is_staff=True)
+        for i in range(users)
+    ])
+
+    statuses = list(Order.OrderStatus.values)
+    order_objs, lines = [], []
+    for i in range(orders if user_objs and product_objs else 0):
+        picked = rng.sample(product_objs, min(lines_per_order, len(product_objs)))
+        order = Order(
+            user=user_objs[i % len(user_objs)],
+            total_price=int(sum(product.price for product in picked)),
+            address=f'{i} Bench Street',
+            zip_code='00000',
+            phone_number=9000000000 + i,
+            status=rng.choice(statuses),
+        )
+        order_objs.append(order)
+        lines.append([
+            OrderProduct(order=order, product=product, quantity=1, unit_price=product.price)
+            for product in picked
+        ])
+    Order.objects.bulk_create(order_objs, batch_size=1000)
+    OrderProduct.objects.bulk_create([line for order_lines in lines for line in order_lines], batch_size=1000)
+
+    rollups.rebuild_day(timezone.localdate())
+    leaderboard.rebuild()
+    for model in (Category, Product, Review):
+        catalog_cache.bump(model)
+    return user_objs
+
+
+class Route:
+    ''' One benchmarked request.
+
+    ``prepare(worker)`` runs untimed before every request and returns the URL kwargs
+    and the JSON body, for requests that need a fresh token or an existing cart line.
+    '''
+
+    def __init__(self, label, url_name, method='get', query='', prepare=None):
+        self.label = label
+        self.url_name = url_name
+        self.method = method
+        self.query = query
+        self.prepare = prepare or (lambda worker: ({}, None))
+
+
+def _cart_line(worker):
+    cart, _ = Cart.objects.get_or_create(user=worker.user)
+    item_id, _, _ = add_to_cart(cart.id, worker.product_id(), 1)
+    return item_id
+
+
+def _checkout(worker):
+    _cart_line(worker)
+    return {}, {'address': '1 Bench Street', 'zip_code': '00000', 'phone_number': '+989000000000'}
+
+
+def _batch(worker):
+    return {}, {'operations': [
+        {'op': 'add', 'product': worker.product_id(), 'quantity': 1} for _ in range(3)
+    ]}
+
+
+ROUTES = [
+    Route('api-root', 'api-root'),
+    Route('reviews', 'reviews'),
+    Route('category', 'category'),
+    Route('products', 'products'),
+    Route('products-facets', 'products', query='facets=true'),
+    Route('bestsellers', 'bestsellers'),
+    Route('product-search', 'product-search', query=f'q={SEARCH_TERM}'),
+    Route('catalog-cache-stats', 'catalog-cache-stats'),
+    Route('sales-analytics', 'sales-analytics', query='group=product'),
+    Route('cart-items', 'cart-item-list'),
+    Route('cart-item-create', 'cart-item-list', 'post',
+          prepare=lambda worker: ({}, {'product': worker.product_id(), 'quantity': 1})),
+    Route('cart-item-batch', 'cart-item-batch', 'post', prepare=_batch),
+    Route('cart-item-update', 'cart-item-detail', 'patch',
+          prepare=lambda worker: ({'pk': _cart_line(worker)}, {'quantity': 2})),
+    Route('cart-item-delete', 'cart-item-detail', 'delete',
+          prepare=lambda worker: ({'pk': _cart_line(worker)}, None)),
+    Route('checkout', 'checkout', 'post', prepare=_checkout),
+    Route('orders', 'orders'),
+    Route('register', 'register', 'post', prepare=lambda worker: ({}, {
+        'email': f'bench-{uuid.uuid4().hex}@example.com', 'password': PASSWORD, 'fullname': 'Bench'})),
+    Route('login', 'login', 'post',
+          prepare=lambda worker: ({}, {'email': worker.user.email, 'password': PASSWORD})),
+    Route('token-refresh', 'token-refresh', 'post',
+          prepare=lambda worker: ({}, {'refresh': str(RefreshToken.for_user(worker.user))})),
+]
+
+
+def uncovered_url_names():
+    ''' Named routes of ``URLCONFS`` that ``ROUTES`` does not exercise. '''
+    names = {
+        name for urlconf in URLCONFS for name in get_resolver(urlconf).reverse_dict
+        if isinstance(name, str)
+    }
+    return sorted(names - {route.url_name for route in ROUTES})
+
+
+class Worker:
+    ''' A test client bound to one user; used by one thread at a time. '''
+
+    def __init__(self, user, product_ids, seed=0):
+        self.user = user
+        self.product_ids = product_ids
+        self.random = random.Random(seed)
+        self.clients = {
+            'anonymous': Client(),
+            'user': Client(headers={'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}),
+        }
+
+    def product_id(self):
+        return self.random.choice(self.product_ids)
+
+    def request(self, route, auth):
+        ''' Send one request; returns ``(seconds, queries, status_code)``. '''
+        kwargs, data = route.prepare(self)
+        path = reverse(route.url_name, kwargs=kwargs)
+        if route.query:
+            path = f'{path}?{route.query}'
+        client = self.clients[auth]
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            if route.method == 'get':
+                response = client.get(path)
+            else:
+                response = getattr(client, route.method)(path, data or {}, content_type='application/json')
+        return time.perf_counter() - started, recorder.count, response.status_code
+
+
+@contextmanager
+def persistent_connections():
+    ''' Keep connections open for the whole run.
+
+    The test client unhooks ``close_old_connections`` around each request and hooks it
+    back afterwards. With several threads one client can re-enable it while another is
+    mid-request, which would close that thread's connection under a finite
+    ``CONN_MAX_AGE``.
+    '''
+    saved = {alias: connections[alias].settings_dict['CONN_MAX_AGE'] for alias in connections}
+    for alias in connections:
+        connections[alias].settings_dict['CONN_MAX_AGE'] = None
+    try:
+        yield
+    finally:
+        for alias, value in saved.items():
+            connections[alias].settings_dict['CONN_MAX_AGE'] = value
+
+
+@contextmanager
+def isolated_caches():
+    ''' Give ``default`` and ``catalog`` private local-memory caches for the run.
+
+    The deployed ``catalog`` alias is shared by every process, so seeding (which bumps
+    the generations) and the benchmarked requests would otherwise fill it with boards
+    and pages built from the benchmark data. The catalog's per-process LRU is emptied
+    on the way in and out for the same reason.
+    '''
+    isolated = {
+        alias: {**settings.CACHES[alias], 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'bench-{alias}'}
+        for alias in ('default', 'catalog')
+    }
+    catalog_cache.local.clear()
+    try:
+        with override_settings(CACHES={**settings.CACHES, **isolated}):
+            try:
+                yield
+            finally:
+                for alias in isolated:
+                    caches[alias].clear()
+    finally:
+        catalog_cache.local.clear()
+
+
+def percentile(ordered, fraction):
+    ''' Nearest-rank percentile of an ascending list. '''
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed, peak_bytes):
+    latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+    return {
+        'requests': len(samples),
+        'status': dict(sorted(Counter(str(code) for _, _, code in samples).items())),
+        'rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'queries_per_request': round(sum(queries for _, queries, _ in samples) / len(samples), 2),
+        'peak_alloc_bytes': peak_bytes,
+    }
+
+
+def run_scenario(route, auth, workers, requests, warmup, trace_memory=False):
+    ''' Send ``requests`` requests split over one thread per worker. '''
+    counts = [requests // len(workers) + (i < requests % len(workers)) for i in range(len(workers))]
+    samples = [[] for _ in workers]
+    clock = {}
+
+    def start_clock():
+        if trace_memory:
+            tracemalloc.reset_peak()
+            clock['memory'] = tracemalloc.get_traced_memory()[0]
+        clock['started'] = time.perf_counter()
+
+    barrier = threading.Barrier(len(workers), action=start_clock)
+
+    def work(index):
+        worker = workers[index]
+        for _ in range(warmup):
+            worker.request(route, auth)
+        barrier.wait()
+        for _ in range(counts[index]):
+            samples[index].append(worker.request(route, auth))
+
+    def thread_work(index):
+        try:
+            work(index)
+        finally:
+            connection.close()
+
+    if len(workers) == 1:
+        # Stay on this thread's connection, which may be inside a test transaction.
+        work(0)
+    else:
+        threads = [threading.Thread(target=thread_work, args=(i,)) for i in range(len(workers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - clock['started']
+    peak = tracemalloc.get_traced_memory()[1] - clock['memory'] if trace_memory else None
+    return summarize([sample for worker_samples in samples for sample in worker_samples], elapsed, peak)
+
+
+def run(users, concurrency=1, requests=100, warmup=5, routes=None, auth_modes=AUTH_MODES,
+        trace_memory=True, progress=None):
+    ''' Benchmark ``routes`` (labels; all by default) and return the report. '''
+    selected = [route for route in ROUTES if routes is None or route.label in routes]
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    workers = [Worker(user, product_ids, seed=i) for i, user in enumerate(users[:concurrency])]
+    results = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with persistent_connections():
+            for route in selected:
+                for auth in auth_modes:
+                    key = f'{route.label}:{auth}'
+                    results[key] = run_scenario(route, auth, workers, requests, warmup, trace_memory)
+                    if progress:
+                        progress(key, results[key])
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return {
+        'concurrency': len(workers),
+        'requests': requests,
+        'warmup': warmup,
+        'trace_memory': trace_memory,
+        'uncovered': uncovered_url_names(),
+        'results': results,
+    }
+
+
+def compare(report, baseline, latency_threshold=0.25, query_threshold=0, memory_threshold=0.25,
+            min_latency_ms=1.0):
+    ''' Regressions of ``report`` against ``baseline`` as readable lines.
+
+    Latency and memory regress when they grow by more than the given fraction; latency
+    must also grow by at least ``min_latency_ms`` so sub-millisecond noise is ignored.
+    Queries per request regress when they grow by more than ``query_threshold``, and a
+    scenario regresses when it answers with different status codes.
+    '''
+    regressions = []
+    for key, result in report['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        if result['status'].keys() != base['status'].keys():
+            regressions.append(f'{key}: status codes {sorted(base["status"])} -> {sorted(result["status"])}')
+        for metric in LATENCY_METRICS:
+            if (result[metric] > base[metric] * (1 + latency_threshold)
+                    and result[metric] - base[metric] >= min_latency_ms):
+                regressions.append(f'{key}: {metric} {base[metric]} -> {result[metric]}')
+        if result['queries_per_request'] > base['queries_per_request'] + query_threshold:
+            regressions.append(
+                f'{key}: queries_per_request {base["queries_per_request"]} -> {result["queries_per_request"]}')
+        if (result['peak_alloc_bytes'] is not None and base.get('peak_alloc_bytes') is not None
+                and result['peak_alloc_bytes'] > base['peak_alloc_bytes'] * (1 + memory_threshold)):
+            regressions.append(
+                f'{key}: peak_alloc_bytes {base["peak_alloc_bytes"]} -> {result["peak_alloc_bytes"]}')
+    return regressions
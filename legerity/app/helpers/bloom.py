@@ -0,0 +1,32 @@
+'''
+Bloom filter for cheap "definitely not in the set" checks.
+'''
+import hashlib
+import math
+
+
+class BloomFilter:
+    ''' Fixed-size set of strings that answers "no" or "maybe".
+
+    Sized for ``capacity`` items at a false-positive rate of ``error_rate``. Adding
+    more items than ``capacity`` keeps it correct but raises the false-positive rate.
+    '''
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: position i is h1 + i * h2 over one 128-bit digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
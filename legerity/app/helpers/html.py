@@ -0,0 +1,77 @@
+'''
+Sanitizing and flattening of rich-text (TinyMCE) content.
+'''
+from html import escape
+from html.parser import HTMLParser
+
+from django.utils.text import Truncator
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img',
+    'li', 'ol', 'p', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+BLOCK_TAGS = {'blockquote', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'p', 'td', 'th', 'tr'}
+SAFE_URL_SCHEMES = ('http:', 'https:', 'mailto:', '/', '#')
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.dropping = 0
+
+    def _attributes(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in ('href', 'src') and not value.strip().lower().startswith(SAFE_URL_SCHEMES):
+                continue
+            kept.append(f' {name}="{escape(value)}"')
+        return ''.join(kept)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag in ALLOWED_TAGS:
+            self.html.append(f'<{tag}{self._attributes(tag, attrs)}>')
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag in ALLOWED_TAGS and tag not in VOID_TAGS:
+            self.html.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.html.append(escape(data, quote=False))
+            self.text.append(data)
+
+
+def render_html(value, excerpt_length=200):
+    ''' Return ``(sanitized_html, plain_text_excerpt, plain_text_length)`` for rich text. '''
+    parser = _Sanitizer()
+    parser.feed(value or '')
+    parser.close()
+    text = ' '.join(''.join(parser.text).split())
+    return ''.join(parser.html), Truncator(text).chars(excerpt_length), len(text)
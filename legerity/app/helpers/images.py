@@ -0,0 +1,37 @@
+'''
+Image resizing that runs inside worker processes.
+
+Nothing here touches Django, so the functions can be shipped to a
+``ProcessPoolExecutor`` started with the ``spawn`` method.
+'''
+import os
+
+from PIL import Image, ImageOps
+
+
+def generate_derivatives(source_path, media_root, prefix, widths, quality=82):
+    ''' Write JPEG and WebP copies of ``source_path`` at each width under ``media_root/prefix``.
+
+    Widths larger than the original are skipped (the original width is used once
+    instead). Returns ``{width: {'jpeg': name, 'webp': name}}`` with media-relative names.
+    '''
+    os.makedirs(os.path.join(media_root, prefix), exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    variants = {}
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        targets = sorted({min(width, image.width) for width in widths})
+        for width in targets:
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            names = {
+                'jpeg': f'{prefix}/{stem}-{width}w.jpg',
+                'webp': f'{prefix}/{stem}-{width}w.webp',
+            }
+            resized.convert('RGB').save(os.path.join(media_root, names['jpeg']), 'JPEG',
+                                        quality=quality, optimize=True, progressive=True)
+            resized.save(os.path.join(media_root, names['webp']), 'WEBP', quality=quality, method=4)
+            variants[str(width)] = names
+    return variants
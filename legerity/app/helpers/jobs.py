@@ -0,0 +1,143 @@
+'''
+A small job queue stored in the database.
+
+Register handlers with ``@job('name')`` in an app's ``jobs.py`` and call ``enqueue``.
+Jobs enqueued inside a transaction become visible to workers only when it commits,
+so a rolled-back request never leaves work behind. Workers claim jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED``; a failing job is retried with exponential
+backoff until ``max_attempts`` and is then kept as ``Failed``.
+
+Maintenance work registered with ``@job('name', every=interval)`` is periodic: each
+run, successful or finally failed, enqueues the next one ``interval`` later, and
+``schedule_periodic`` (called when ``run_worker`` starts) enqueues any periodic job
+that has no queued or running instance.
+'''
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from helpers.models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+periodic = {}
+
+SCHEDULE_LOCK_ID = 160016
+
+
+def job(name, every=None):
+    ''' Register the decorated function as the handler for jobs called ``name``.
+
+    With ``every`` (a ``timedelta``) the job is periodic and re-enqueues itself.
+    '''
+    def decorator(func):
+        registry[name] = func
+        if every is not None:
+            periodic[name] = every
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, delay=None, max_attempts=None):
+    if name not in registry:
+        raise KeyError(f'Unknown job {name!r}')
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def schedule_periodic():
+    ''' Enqueue the periodic jobs that are not queued or running; returns how many. '''
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [SCHEDULE_LOCK_ID])
+        active = set(
+            Job.objects.filter(name__in=list(periodic), status__in=[Job.JobStatus.queued, Job.JobStatus.running])
+            .values_list('name', flat=True)
+        )
+        missing = [name for name in periodic if name not in active]
+        for name in missing:
+            enqueue(name)
+    return len(missing)
+
+
+def _reschedule(claimed):
+    if claimed.name in periodic:
+        enqueue(claimed.name, claimed.payload, delay=periodic[claimed.name])
+
+
+def backoff(attempts):
+    seconds = settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.JOBS_RETRY_BACKOFF_MAX))
+
+
+def claim(batch_size=1):
+    ''' Lock and mark as running up to ``batch_size`` due jobs. '''
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.JobStatus.queued, run_at__lte=now)
+            .order_by('run_at')[:batch_size]
+        )
+        for claimed in jobs:
+            claimed.status = Job.JobStatus.running
+            claimed.locked_at = now
+            claimed.attempts += 1
+        Job.objects.bulk_update(jobs, ['status', 'locked_at', 'attempts'])
+    return jobs
+
+
+def run(claimed):
+    ''' Run one claimed job; its effects and its removal from the queue commit together.
+
+    A failing ``on_commit`` callback of the job runs after that commit, so the job is
+    done and is only logged, not retried.
+    '''
+    committed = []
+    try:
+        with transaction.atomic():
+            transaction.on_commit(lambda: committed.append(True))
+            registry[claimed.name](**claimed.payload)
+            claimed.delete()
+            _reschedule(claimed)
+        return True
+    except Exception:
+        if committed:
+            logger.exception('Job %s committed, but an on-commit callback failed', claimed)
+            return True
+        logger.exception('Job %s failed (attempt %s)', claimed, claimed.attempts)
+        claimed.last_error = traceback.format_exc()
+        claimed.locked_at = None
+        with transaction.atomic():
+            if claimed.attempts >= claimed.max_attempts:
+                claimed.status = Job.JobStatus.failed
+                _reschedule(claimed)
+            else:
+                claimed.status = Job.JobStatus.queued
+                claimed.run_at = timezone.now() + backoff(claimed.attempts)
+            claimed.save(update_fields=['status', 'run_at', 'locked_at', 'last_error'])
+        return False
+
+
+def work(batch_size=10):
+    ''' Claim and run one batch; returns the number of jobs processed. '''
+    jobs = claim(batch_size)
+    for claimed in jobs:
+        run(claimed)
+    return len(jobs)
+
+
+def requeue_stale(timeout):
+    ''' Put jobs whose worker died mid-run back in the queue. '''
+    return Job.objects.filter(
+        status=Job.JobStatus.running, locked_at__lt=timezone.now() - timeout,
+    ).update(status=Job.JobStatus.queued, locked_at=None, run_at=timezone.now())
@@ -0,0 +1,110 @@
+'''
+Django command to benchmark the API endpoints and compare against a baseline.
+'''
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from helpers import bench
+
+
+class Command(BaseCommand):
+    ''' Django command to measure latency, queries and memory of every API route.
+
+    A throwaway test database is created, seeded with ``--products`` etc. and dropped
+    afterwards; the caches are replaced by private local memory for the run. The JSON report goes to stdout or ``--output``; progress goes to
+    stderr. With ``--baseline`` the command fails when a scenario regresses beyond the
+    thresholds, so a saved report can gate changes in CI.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=200)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads, one user each.')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per route and auth mode.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per thread first.')
+        parser.add_argument('--route', action='append', dest='routes', metavar='LABEL',
+                            choices=[route.label for route in bench.ROUTES], help='Only these routes.')
+        parser.add_argument('--auth', nargs='+', choices=bench.AUTH_MODES, default=list(bench.AUTH_MODES))
+        parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc.')
+        parser.add_argument('--no-test-database', action='store_true',
+                            help='Seed and run against the configured database; only for one you can discard.')
+        parser.add_argument('--output', help='File to write the report to; stdout when omitted.')
+        parser.add_argument('--baseline', help='Report to compare against.')
+        parser.add_argument('--latency-threshold', type=float, default=0.25,
+                            help='Allowed relative growth of p50/p95/p99.')
+        parser.add_argument('--min-latency-ms', type=float, default=1.0,
+                            help='Latency growth below this is treated as noise.')
+        parser.add_argument('--query-threshold', type=float, default=0,
+                            help='Allowed extra queries per request.')
+        parser.add_argument('--memory-threshold', type=float, default=0.25,
+                            help='Allowed relative growth of peak allocation.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        with bench.isolated_caches():
+            if options['no_test_database']:
+                report = self.bench(options)
+            else:
+                self.stderr.write('Creating test database...')
+                old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'},
+                                             serialized_aliases=set())
+                try:
+                    report = self.bench(options)
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = bench.compare(
+                report, baseline,
+                latency_threshold=options['latency_threshold'],
+                query_threshold=options['query_threshold'],
+                memory_threshold=options['memory_threshold'],
+                min_latency_ms=options['min_latency_ms'],
+            )
+            if regressions:
+                raise CommandError('Regressions against baseline:\n' + '\n'.join(regressions))
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Wrote benchmark report to {options["output"]}.'))
+
+    def bench(self, options):
+        dataset = {name: options[name] for name in ('categories', 'products', 'reviews', 'users', 'orders')}
+        self.stderr.write('Seeding {products} products and {orders} orders...'.format(**dataset))
+        users = bench.seed(**{**dataset, 'users': max(options['users'], options['concurrency'])})
+
+        def progress(key, result):
+            self.stderr.write(
+                f'{key:>32}: p50 {result["p50_ms"]}ms, p95 {result["p95_ms"]}ms, '
+                f'{result["queries_per_request"]} queries, status {result["status"]}')
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False):
+            report = bench.run(
+                users,
+                concurrency=options['concurrency'],
+                requests=options['requests'],
+                warmup=options['warmup'],
+                routes=options['routes'],
+                auth_modes=options['auth'],
+                trace_memory=not options['no_memory'],
+                progress=progress,
+            )
+        return {'dataset': dataset, **report}
@@ -0,0 +1,83 @@
+'''
+Django command to process background jobs.
+'''
+import logging
+import signal
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from helpers import jobs
+
+logger = logging.getLogger(__name__)
+
+# Longest pause, in seconds, after repeated failures of the queue itself
+MAX_ERROR_PAUSE = 60
+
+
+class Command(BaseCommand):
+    ''' Django command to run job worker threads until stopped. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Worker threads.')
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed at a time per thread.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a running job is assumed lost and requeued.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        self.stopping = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stopping.set())
+            signal.signal(signal.SIGINT, lambda *_: self.stopping.set())
+
+        requeued = jobs.requeue_stale(timedelta(seconds=options['stale_after']))
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs.')
+        scheduled = jobs.schedule_periodic()
+        if scheduled:
+            self.stdout.write(f'Scheduled {scheduled} periodic jobs.')
+
+        self.stdout.write(f'Starting {options["concurrency"]} worker threads...')
+        if options['concurrency'] == 1:
+            self.loop(options, close_connection=False)
+        else:
+            threads = [
+                threading.Thread(target=self.loop, args=(options,), daemon=True)
+                for _ in range(options['concurrency'])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+
+        self.stdout.write(self.style.SUCCESS('Worker stopped.'))
+
+    def loop(self, options, close_connection=True):
+        failures = 0
+        try:
+            while not self.stopping.is_set():
+                try:
+                    worked = jobs.work(options['batch_size'])
+                except Exception:
+                    # The queue itself failed (e.g. the database went away): start over
+                    # on a new connection after a growing pause instead of ending the thread.
+                    failures += 1
+                    logger.exception('Worker loop failed (%s in a row)', failures)
+                    connection.close()
+                    self.stopping.wait(min(options['poll_interval'] * 2 ** failures, MAX_ERROR_PAUSE))
+                    continue
+                failures = 0
+                if worked:
+                    continue
+                if options['burst']:
+                    break
+                self.stopping.wait(options['poll_interval'])
+        finally:
+            if close_connection:
+                connection.close()
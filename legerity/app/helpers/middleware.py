@@ -0,0 +1,130 @@
+'''
+Per-request database query instrumentation.
+'''
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('helpers.queries')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    ''' Reduce SQL to its shape: literals and placeholders become ``?`` and ``IN`` lists collapse. '''
+    sql = _STRING.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    ''' ``connection.execute_wrapper`` that times every query and counts its shape. '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[normalize_sql(sql)] += 1
+
+    def repeated(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def install(self):
+        ''' Wrap every connection of the current thread; close the returned stack to unwrap. '''
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class QueryInstrumentationMiddleware:
+    ''' Record query count, DB time and repeated SQL shapes for a sample of requests.
+
+    A sampled response gets a ``Server-Timing`` header (``db`` and ``app`` durations)
+    and one JSON log line on the ``helpers.queries`` logger. That line is a warning
+    when a shape repeats more than ``QUERY_INSTRUMENTATION_REPEAT_THRESHOLD`` times,
+    which usually means an N+1. Unsampled requests cost one ``random()`` call, and with
+    ``QUERY_INSTRUMENTATION_SAMPLE_RATE = 0`` the middleware removes itself. Queries run
+    while a streaming response is consumed are not seen.
+
+    It runs sync or async to match the rest of the chain, so it does not force ASGI
+    requests through a thread. Connections are per thread and async code runs its
+    queries in the request's thread-sensitive executor, so the async path installs the
+    recorder there.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.QUERY_INSTRUMENTATION_SAMPLE_RATE
+        self.threshold = settings.QUERY_INSTRUMENTATION_REPEAT_THRESHOLD
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed()
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.install():
+            response = self.get_response(request)
+        return self.report(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        stack = await sync_to_async(recorder.install)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, recorder, time.perf_counter() - started)
+
+    def report(self, request, response, recorder, total):
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f'app;dur={(total - recorder.duration) * 1000:.1f}'
+        )
+        repeated = recorder.repeated(self.threshold)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'repeated': [{'sql': shape, 'count': count} for shape, count in repeated[:5]],
+        }
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record))
+        return response
@@ -1,3 +1,30 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
+
+class Job(models.Model):
+    ''' A unit of background work, claimed by ``manage.py run_worker``. '''
+    class JobStatus(models.TextChoices):
+        queued = 'Queued', 'Queued'
+        running = 'Running', 'Running'
+        failed = 'Failed', 'Failed'
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField('Status', max_length=10, choices=JobStatus.choices, default=JobStatus.queued)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at'], name='job_ready_idx', condition=models.Q(status='Queued')),
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=models.Q(status='Running')),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
@@ -0,0 +1,37 @@
+'''
+Admin paginator that avoids exact counts on big tables.
+'''
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    ''' Use the planner's row estimate instead of ``COUNT(*)`` for unfiltered big tables.
+
+    ``pg_class.reltuples`` is refreshed by ``VACUUM``/``ANALYZE``, so the total shown on
+    an unfiltered changelist can be slightly off. Filtered lists and tables below
+    ``exact_count_limit`` rows are still counted exactly.
+    '''
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None or query.where or query.distinct or query.combinator:
+            return super().count
+        estimate = self.estimate(queryset)
+        if estimate is None or estimate < self.exact_count_limit:
+            return super().count
+        return estimate
+
+    def estimate(self, queryset):
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that were never vacuumed or analyzed.
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
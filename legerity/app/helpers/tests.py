@@ -1,3 +1,256 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+
+import json
+import os
+import tempfile
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, transaction
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from helpers import bench
+from shopping import leaderboard
+from shopping.cache import catalog_cache
+from shopping.models import Product
+from helpers.bloom import BloomFilter
+from helpers.cache import LRUCache
+from helpers.html import render_html
+from helpers.middleware import QueryInstrumentationMiddleware, normalize_sql
+from helpers.paginator import EstimatedCountPaginator
+from helpers import jobs
+from helpers.models import Job
 
 # Create your tests here.
+
+class LRUCacheTest(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class BloomFilterTest(SimpleTestCase):
+    def test_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        members = [f'member-{i}' for i in range(1000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RenderHTMLTest(SimpleTestCase):
+    def test_sanitizes_and_flattens(self):
+        html, excerpt, length = render_html(
+            '<p onclick="x()">Soft <b>leather</b></p><script>alert(1)</script>'
+            '<p><a href="javascript:x()">more</a> &amp; <a href="https://a.az">less</a></p>')
+        self.assertEqual(html, '<p>Soft <b>leather</b></p><p><a>more</a> &amp; <a href="https://a.az">less</a></p>')
+        self.assertEqual(excerpt, 'Soft leather more & less')
+        self.assertEqual(length, len(excerpt))
+
+    def test_truncates_excerpt(self):
+        _, excerpt, length = render_html('<p>' + 'word ' * 100 + '</p>', excerpt_length=20)
+        self.assertEqual(len(excerpt), 20)
+        self.assertEqual(length, 499)
+
+
+calls = []
+
+
+@jobs.job('helpers.tests.flaky')
+def flaky(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise ValueError('boom')
+
+
+@jobs.job('helpers.tests.notify')
+def notify(value):
+    calls.append(value)
+    transaction.on_commit(lambda: flaky('notified', fail=True))
+
+
+@jobs.job('helpers.tests.tick', every=timedelta(minutes=5))
+def tick():
+    calls.append('tick')
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_due_jobs(self):
+        jobs.enqueue('helpers.tests.flaky', {'value': 1})
+        jobs.enqueue('helpers.tests.flaky', {'value': 2}, delay=timedelta(hours=1))
+        call_command('run_worker', burst=True, stdout=StringIO())
+        self.assertEqual([value for value in calls if value != 'tick'], [1])
+        self.assertEqual(Job.objects.get(name='helpers.tests.flaky').payload, {'value': 2})
+
+    def test_retries_with_backoff_then_fails(self):
+        queued = jobs.enqueue('helpers.tests.flaky', {'value': 1, 'fail': True}, max_attempts=2)
+        self.assertEqual(jobs.work(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Job.JobStatus.queued, 1))
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('boom', queued.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        jobs.work()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Job.JobStatus.failed, 2))
+        self.assertEqual(jobs.work(), 0)
+
+    def test_periodic_jobs_reschedule_themselves(self):
+        self.assertEqual(jobs.schedule_periodic(), len(jobs.periodic))
+        self.assertEqual(jobs.schedule_periodic(), 0)
+        self.assertLessEqual({
+            'shopping.release_reservations', 'shopping.fold_sales_counters', 'customer.prune_token_blacklist',
+        }, set(jobs.periodic))
+
+        Job.objects.exclude(name='helpers.tests.tick').delete()
+        self.assertEqual(jobs.work(), 1)
+        self.assertEqual(calls, ['tick'])
+        queued = Job.objects.get()
+        self.assertEqual((queued.name, queued.status), ('helpers.tests.tick', Job.JobStatus.queued))
+        self.assertGreater(queued.run_at, timezone.now() + timedelta(minutes=4))
+
+    def test_requeues_stale_jobs(self):
+        jobs.enqueue('helpers.tests.flaky', {'value': 1})
+        jobs.claim()
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(timedelta(minutes=10)), 1)
+        self.assertEqual(jobs.work(), 1)
+
+    def test_worker_survives_queue_errors(self):
+        with mock.patch('helpers.jobs.work', side_effect=[OperationalError('gone'), 0]) as work, \
+                self.assertLogs('helpers.management.commands.run_worker', 'ERROR'):
+            call_command('run_worker', burst=True, poll_interval=0, stdout=StringIO())
+        self.assertEqual(work.call_count, 2)
+
+
+class JobCommitTest(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_failing_on_commit_callback_does_not_fail_the_job(self):
+        jobs.enqueue('helpers.tests.notify', {'value': 1})
+        with self.assertLogs('helpers.jobs', 'ERROR'):
+            self.assertEqual(jobs.work(), 1)
+        self.assertEqual(calls, [1, 'notified'])
+        self.assertFalse(Job.objects.exists())
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    class Paginator(EstimatedCountPaginator):
+        exact_count_limit = 0
+
+        def estimate(self, queryset):
+            return 1000000
+
+    def setUp(self):
+        for _ in range(3):
+            jobs.enqueue('helpers.tests.flaky')
+
+    def test_estimate_only_for_unfiltered_lists(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.Paginator(Job.objects.order_by('id'), 10).count, 1000000)
+        self.assertEqual(self.Paginator(Job.objects.filter(attempts=0).order_by('id'), 10).count, 3)
+
+    def test_small_tables_are_counted(self):
+        self.assertEqual(EstimatedCountPaginator(Job.objects.order_by('id'), 10).count, 3)
+
+
+class QueryInstrumentationMiddlewareTest(TestCase):
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s,%s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+
+    def test_disabled_without_sample_rate(self):
+        with self.settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=0), self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(lambda request: HttpResponse())
+
+    def test_flags_repeated_queries(self):
+        def view(request):
+            for job_id in range(7):
+                list(Job.objects.filter(id=job_id))
+            return HttpResponse()
+
+        with self.settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=1, QUERY_INSTRUMENTATION_REPEAT_THRESHOLD=5):
+            middleware = QueryInstrumentationMiddleware(view)
+        with self.assertLogs('helpers.queries', 'WARNING') as logs:
+            response = middleware(RequestFactory().get('/jobs/'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="7 queries", app;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['queries']), ('/jobs/', 7))
+        self.assertEqual(record['repeated'][0]['count'], 7)
+
+    async def test_async_chain(self):
+        async def view(request):
+            for job_id in range(3):
+                await Job.objects.filter(id=job_id).acount()
+            return HttpResponse()
+
+        with self.settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=1):
+            middleware = QueryInstrumentationMiddleware(view)
+            self.assertFalse(iscoroutinefunction(QueryInstrumentationMiddleware(lambda request: HttpResponse())))
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('helpers.queries', 'INFO'):
+            response = await middleware(AsyncRequestFactory().get('/jobs/'))
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+
+
+class BenchCommandTest(TestCase):
+    def bench(self, *args):
+        call_command(
+            'bench', '--no-test-database', '--products=20', '--orders=10', '--users=2',
+            '--concurrency=1', '--requests=3', '--warmup=1', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_every_route_is_covered(self):
+        self.assertEqual(bench.uncovered_url_names(), [])
+
+    def test_report_and_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            generation = catalog_cache.generations([Product])
+            self.bench('--route=products', '--route=checkout', f'--output={path}')
+            self.assertEqual(catalog_cache.generations([Product]), generation)
+            self.assertIsNone(caches['catalog'].get(leaderboard.board_key('all')))
+            with open(path) as file:
+                report = json.load(file)
+
+            self.assertEqual(set(report['results']), {
+                'products:anonymous', 'products:user', 'checkout:anonymous', 'checkout:user'})
+            checkout = report['results']['checkout:user']
+            self.assertEqual((checkout['requests'], checkout['status']), (3, {'201': 3}))
+            self.assertEqual(report['results']['checkout:anonymous']['status'], {'401': 3})
+            self.assertGreater(checkout['queries_per_request'], 0)
+            self.assertGreater(checkout['peak_alloc_bytes'], 0)
+            self.assertLessEqual(checkout['p50_ms'], checkout['p99_ms'])
+
+            checkout['queries_per_request'] -= 1
+            with open(path, 'w') as file:
+                json.dump(report, file)
+            with self.assertRaisesMessage(CommandError, 'checkout:user: queries_per_request'):
+                self.bench('--route=checkout', '--auth=user', '--no-memory', f'--baseline={path}',
+                           '--latency-threshold=1000')
@@ -1,25 +1,106 @@
 from django.contrib import admin
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from shopping.models import About,Review, Category,Cart,CartItem,Order,OrderProduct,Product
+from shopping.images import schedule_derivatives
+from shopping.exports import FORMATS, export_orders, export_queryset
+from helpers.admin import LargeTableAdmin
 # Register your models here.
 
 # class CategoryAdmin(admin.ModelAdmin):
 #     list_display=['id','title']
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
+    ''' Product edits that leave concurrent stock changes alone.
+
+    Checkouts and cart reservations move ``stock`` with relative updates while an admin
+    form is open. The form therefore carries the stock it was loaded with, an edit is
+    applied as the difference from that value, and a change only writes the fields the
+    form edits. ``sales_number`` is only moved by ``shopping.counters.fold``, so it is
+    read-only here.
+    '''
     list_display=['category','price','stock']
+    list_select_related=['category']
+    raw_id_fields=['category']
+    readonly_fields=['sales_number']
+    relative_fields=['stock']
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        for name in self.relative_fields:
+            if name in form.base_fields:
+                form.base_fields[name].show_hidden_initial = True
+        return form
+
+    def loaded_value(self, form, name):
+        ''' The value of ``name`` when the form was rendered, from its hidden initial input. '''
+        field = form.fields[name]
+        value = field.hidden_widget().value_from_datadict(form.data, form.files, form[name].html_initial_name)
+        return form.initial[name] if value is None else field.to_python(value)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+        else:
+            deltas = {
+                name: form.cleaned_data[name] - self.loaded_value(form, name)
+                for name in self.relative_fields if name in form.cleaned_data
+            }
+            obj.save(update_fields=[name for name in form.fields if name not in deltas] + ['updated_at'])
+            deltas = {name: delta for name, delta in deltas.items() if delta}
+            if deltas:
+                Product.objects.filter(pk=obj.pk).update(
+                    **{name: Greatest(F(name) + delta, 0) for name, delta in deltas.items()})
+                obj.refresh_from_db(fields=list(deltas))
+        if 'image' in form.changed_data:
+            schedule_derivatives(obj)
+
+class CartAdmin(LargeTableAdmin):
+    list_select_related=['user']
+    raw_id_fields=['user']
 
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display=['cart','product','quantity']
+    list_select_related=['cart__user','product']
+    raw_id_fields=['cart','product']
 
-class OrderAdmin(admin.ModelAdmin):
+def export_response(queryset, format):
+    chunks = export_orders(export_queryset(queryset), format=format)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+    filename = f'orders-{timezone.localdate():%Y%m%d}.{format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+class OrderAdmin(LargeTableAdmin):
     list_display = ('id', 'user', 'total_price', 'status', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+    actions = ['export_csv', 'export_ndjson']
+
+    @admin.action(description='Export selected orders as CSV')
+    def export_csv(self, request, queryset):
+        return export_response(queryset, 'csv')
+
+    @admin.action(description='Export selected orders as NDJSON')
+    def export_ndjson(self, request, queryset):
+        return export_response(queryset, 'ndjson')
+
+
+class OrderProductAdmin(LargeTableAdmin):
+    list_display = ('order', 'product', 'quantity', 'unit_price')
+    list_select_related = ('order', 'product')
+    raw_id_fields = ('order', 'product')
 
 
 admin.site.register(About)
 admin.site.register(Review)
 admin.site.register(Category)
-admin.site.register(Cart)
+admin.site.register(Cart, CartAdmin)
 admin.site.register(CartItem, CartItemAdmin)
 admin.site.register(Order,OrderAdmin)
-admin.site.register(OrderProduct)
+admin.site.register(OrderProduct, OrderProductAdmin)
 admin.site.register(Product,ProductAdmin)
\ No newline at end of file
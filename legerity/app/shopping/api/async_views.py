@@ -0,0 +1,100 @@
+'''
+Native async versions of the public catalog endpoints.
+
+Under an ASGI server these views await the database and the catalog cache instead of
+holding a worker thread, so one process can keep many slow clients open at once. They
+reuse the querysets, serializers and paginators of the sync views in
+``shopping.api.views`` and return the same bodies and headers, including ``ETag``,
+``Last-Modified`` and ``X-Cache``. The endpoints are anonymous, so no authentication
+runs.
+'''
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from shopping.api import views
+from shopping.api.mixins import conditional_validators, set_conditional_headers
+from shopping.cache import catalog_cache
+
+
+class AsyncListView(View):
+    ''' Serve ``list_view`` through the async ORM with its conditional and cache layers. '''
+    list_view = None
+    http_method_names = ['get', 'head', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request)
+        view = self.list_view(request=request, format_kwarg=None, args=args, kwargs=kwargs)
+        try:
+            return await self.list(request, view)
+        except APIException as exc:
+            return self.error_response(exc)
+
+    async def list(self, request, view):
+        uri = request.build_absolute_uri()
+        etag, last_modified = conditional_validators(uri, await self.get_validators(view.cache_models))
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None and view.is_streaming(request):
+            queryset = view.filter_queryset(view.get_queryset()).order_by(*view.stream_ordering)
+            response = StreamingHttpResponse(view.astream(queryset), content_type='application/json')
+            response['X-Cache'] = 'BYPASS'
+        elif response is None:
+            key, data = await catalog_cache.aget(view.cache_models, uri)
+            cache_status = 'HIT'
+            if data is None:
+                data = await self.get_data(request, view)
+                await catalog_cache.aset(key, data)
+                cache_status = 'MISS'
+            response = self.json_response(data)
+            response['X-Cache'] = cache_status
+        return set_conditional_headers(response, etag, last_modified)
+
+    async def get_validators(self, models):
+        key, validators = await catalog_cache.aget(models, 'validators')
+        if validators is None:
+            generations = await catalog_cache.agenerations(models)
+            validators = [
+                {**await model.objects.aaggregate(last_modified=Max('updated_at'), count=Count('id')),
+                 'generation': generation}
+                for model, generation in zip(models, generations)
+            ]
+            await catalog_cache.aset(key, validators)
+        return validators
+
+    async def get_data(self, request, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        if paginator is None:
+            return view.get_serializer([obj async for obj in queryset], many=True).data
+        page = await paginator.apaginate_queryset(queryset, request, view=view)
+        return paginator.get_paginated_data(view.get_serializer(page, many=True).data)
+
+    def json_response(self, data, status=200):
+        return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder,
+                            json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+    def error_response(self, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return self.json_response(data, status=exc.status_code)
+
+
+class AsyncReviewListView(AsyncListView):
+    list_view = views.ReviewListView
+
+
+class AsyncCategoryListView(AsyncListView):
+    list_view = views.CategoryListView
+
+
+class AsyncProductListView(AsyncListView):
+    list_view = views.ProductListView
+
+    async def get_data(self, request, view):
+        data = await super().get_data(request, view)
+        if view.get_filters()['facets']:
+            data['facets'] = view.build_facets([row async for row in view.get_facet_rows()])
+        return data
@@ -0,0 +1,140 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from shopping.cache import catalog_cache
+
+
+class CachedListMixin:
+    ''' Serve list responses from the catalog cache, keyed by the generations of ``cache_models``. '''
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        key, data = catalog_cache.get(self.cache_models, request.build_absolute_uri())
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            catalog_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class StreamingListMixin:
+    ''' Stream the whole filtered list as one JSON array with ``?stream=true``.
+
+    Rows come from a server-side cursor and are serialized one at a time, so memory
+    stays flat however long the list is. Streamed lists skip pagination and the
+    catalog cache.
+    '''
+    stream_query_param = 'stream'
+    stream_ordering = ('pk',)
+
+    def is_streaming(self, request):
+        return request.query_params.get(self.stream_query_param) in ('1', 'true')
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*self.stream_ordering)
+        response = StreamingHttpResponse(self.stream(queryset), content_type='application/json')
+        response['X-Cache'] = 'BYPASS'
+        return response
+
+    def stream(self, queryset):
+        chunks = JSONArrayChunks(self.get_serializer())
+        for obj in queryset.iterator(chunk_size=chunks.size):
+            yield from chunks.add(obj)
+        yield chunks.close()
+
+    async def astream(self, queryset):
+        chunks = JSONArrayChunks(self.get_serializer())
+        async for obj in queryset.aiterator(chunk_size=chunks.size):
+            for chunk in chunks.add(obj):
+                yield chunk
+        yield chunks.close()
+
+
+class JSONArrayChunks:
+    ''' Serialize objects one by one into a JSON array emitted ``size`` rows at a time. '''
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def __init__(self, serializer, size=None):
+        self.serializer = serializer
+        self.size = size or settings.STREAM_CHUNK_SIZE
+        self.rows = ['[']
+        self.separator = ''
+
+    def add(self, obj):
+        self.rows.append(self.separator + self.encoder.encode(self.serializer.to_representation(obj)))
+        self.separator = ','
+        if len(self.rows) >= self.size:
+            chunk, self.rows = ''.join(self.rows), []
+            return [chunk]
+        return []
+
+    def close(self):
+        return ''.join(self.rows) + ']'
+
+
+def conditional_validators(request_uri, validators):
+    ''' Return ``(etag, last_modified)`` for a list built from ``validators``.
+
+    ``max(updated_at)`` does not move when a row is deleted, so ``Last-Modified`` is
+    also at least the time of each model's catalog generation, which every save and
+    delete sets to the current time in nanoseconds.
+    '''
+    timestamps = [v['last_modified'].timestamp() for v in validators if v['last_modified']]
+    timestamps += [v['generation'] / 1e9 for v in validators if v.get('generation')]
+    last_modified = int(max(timestamps)) if timestamps else None
+    fingerprint = '|'.join(
+        [request_uri] +
+        [f"{v['last_modified'] and v['last_modified'].isoformat()}:{v['count']}:{v.get('generation')}"
+         for v in validators]
+    )
+    return quote_etag(hashlib.md5(fingerprint.encode()).hexdigest()), last_modified
+
+
+def set_conditional_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalListMixin:
+    ''' Answer unchanged lists with ``304 Not Modified`` before anything is serialized.
+
+    The validators are ``max(updated_at)``, the row count and the catalog generation
+    of every model in ``cache_models``; they are memoized in the catalog cache, so they
+    are only recomputed after one of those models changes.
+    '''
+    cache_models = ()
+
+    def get_validators(self):
+        key, validators = catalog_cache.get(self.cache_models, 'validators')
+        if validators is None:
+            generations = catalog_cache.generations(self.cache_models)
+            validators = [
+                {**model.objects.aggregate(last_modified=Max('updated_at'), count=Count('id')),
+                 'generation': generation}
+                for model, generation in zip(self.cache_models, generations)
+            ]
+            catalog_cache.set(key, validators)
+        return validators
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = conditional_validators(request.build_absolute_uri(), self.get_validators())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return set_conditional_headers(response, etag, last_modified)
@@ -0,0 +1,182 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ''' Cursor pagination that seeks on ``(ordering field, id)`` instead of using OFFSET.
+
+    Every page is a single indexed range scan, so page 1000 costs the same as page 1.
+    Cursors are opaque base64 tokens holding the last seen position and the direction.
+    '''
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    ordering_fields = ('id', '-id')
+    default_ordering = 'id'
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.finish_page([obj async for obj in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        ''' Return the sliced queryset for the requested page (one row more than a page). '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, view)
+        self.cursor = self.decode_cursor(request)
+
+        position, reverse = self.cursor if self.cursor else (None, False)
+        keys = self.get_keys(reverse)
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(keys, position))
+        queryset = queryset.order_by(*('-' + name if desc else name for name, desc in keys))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, results):
+        reverse = bool(self.cursor and self.cursor[1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering in self.ordering_fields:
+            return ordering
+        return getattr(view, 'default_ordering', self.default_ordering)
+
+    def get_keys(self, reverse=False):
+        ''' Return ``[(field, descending), ...]`` with the tiebreaker appended. '''
+        name = self.ordering.lstrip('-')
+        desc = self.ordering.startswith('-')
+        keys = [(name, desc)]
+        if name != self.tiebreaker:
+            keys.append((self.tiebreaker, desc))
+        if reverse:
+            keys = [(field, not field_desc) for field, field_desc in keys]
+        return keys
+
+    def seek_filter(self, keys, position):
+        ''' Build ``(a > x) OR (a = x AND b > y)`` for the given sort keys. '''
+        condition = Q()
+        equal = {}
+        for (name, desc), value in zip(keys, position):
+            lookup = '%s__%s' % (name, 'lt' if desc else 'gt')
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        return [self.encode_value(getattr(instance, name)) for name, _ in self.get_keys()]
+
+    def encode_value(self, value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'o': self.ordering, 'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        token = urlsafe_b64encode(payload.encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.cursor_query_param, token)
+        return replace_query_param(url, self.ordering_query_param, self.ordering)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(token.encode()))
+            position, reverse = payload['p'], bool(payload['r'])
+            if payload['o'] != self.ordering or len(position) != len(self.get_keys()):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'schema': {'type': 'integer'}},
+            {'name': self.ordering_query_param, 'required': False, 'in': 'query',
+             'schema': {'type': 'string', 'enum': list(self.ordering_fields)}},
+        ]
+
+
+class ProductPagination(KeysetPagination):
+    ordering_fields = ('id', '-id', 'price', '-price', 'sales_number', '-sales_number')
+
+
+class SearchPagination(KeysetPagination):
+    ordering_fields = ('-rank',)
+    default_ordering = '-rank'
+
+
+class OrderHistoryPagination(KeysetPagination):
+    ordering_fields = ('-created_at',)
+    default_ordering = '-created_at'
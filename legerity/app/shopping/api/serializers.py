@@ -1,7 +1,17 @@
+from datetime import timedelta
 from rest_framework import serializers
+from django.utils import timezone
 from django.core.validators import RegexValidator
-from shopping.models import About, Product, Review, Category, CartItem, Cart, Order, OrderProduct
-from customer.models import User
+from django.core.files.storage import default_storage
+from shopping.models import Product, Review, Category, CartItem, Cart, Order, OrderProduct
+from helpers import jobs
+from shopping import leaderboard
+from shopping.stock import InsufficientStock, adjust_stock
+
+# Cart quantities are 32-bit integer columns and product ids 64-bit ones; larger values
+# would only fail in Postgres.
+MAX_QUANTITY = 2 ** 31 - 1
+MAX_ID = 2 ** 63 - 1
 
 phone_number_validator = RegexValidator(
     regex=r'^(\+[0-9]{1,3})?[0-9]{9,15}$',
@@ -10,6 +20,7 @@ phone_number_validator = RegexValidator(
 
 
 class ReviewListSerializer(serializers.ModelSerializer):
+    comment = serializers.CharField(source='comment_excerpt', read_only=True)
 
     class Meta:
         model = Review
@@ -27,16 +38,58 @@ class ProductListSerializer(serializers.ModelSerializer):
     category = CategoryListSerializer(read_only=True)
     name = serializers.SerializerMethodField()
     info = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'info', 'price', 'image', 'category']
+        fields = ['id', 'name', 'info', 'price', 'image', 'image_srcset', 'category']
 
     def get_name(self, obj):
         return f'{obj.category.title}'
 
     def get_info(self, obj):
-        return str(obj.info) if obj.info else ''
+        return obj.info_excerpt
+
+    def get_image_srcset(self, obj):
+        ''' ``{width: {'jpeg': url, 'webp': url}}`` for the resized copies of the image. '''
+        request = self.context.get('request')
+        srcset = {}
+        for width, names in (obj.image_variants or {}).items():
+            urls = {kind: default_storage.url(name) for kind, name in names.items()}
+            if request is not None:
+                urls = {kind: request.build_absolute_uri(url) for kind, url in urls.items()}
+            srcset[width] = urls
+        return srcset
+
+
+class BestSellerFilterSerializer(serializers.Serializer):
+    category = serializers.IntegerField(required=False)
+    window = serializers.ChoiceField(choices=list(leaderboard.WINDOWS), default='all')
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    category = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    in_stock = serializers.BooleanField(default=False)
+    facets = serializers.BooleanField(default=False)
+
+
+class SalesAnalyticsFilterSerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    group = serializers.ChoiceField(choices=['day', 'product', 'category'], default='day')
+    product = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault('until', timezone.localdate())
+        attrs.setdefault('since', attrs['until'] - timedelta(days=29))
+        if attrs['since'] > attrs['until']:
+            raise serializers.ValidationError({'since': 'Must not be after until.'})
+        if 'category' in attrs and (attrs['group'] == 'product' or 'product' in attrs):
+            raise serializers.ValidationError({'category': 'Cannot be combined with product figures.'})
+        return attrs
 
 
 class CartItemListSerializer(serializers.ModelSerializer):
@@ -48,7 +101,8 @@ class CartItemListSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'subtotal_price']
 
     def get_subtotal_price(self, obj):
-        return obj.subtotal_price
+        subtotal = getattr(obj, 'subtotal', None)
+        return obj.subtotal_price if subtotal is None else subtotal
 
 
 class CartItemCreateSerializer(serializers.ModelSerializer):
@@ -75,6 +129,31 @@ class CartItemUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'This field is required.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_operations(self, operations):
+        added = {}
+        for operation in operations:
+            if operation['op'] == 'add':
+                added[operation['product']] = added.get(operation['product'], 0) + operation['quantity']
+        if any(quantity > MAX_QUANTITY for quantity in added.values()):
+            raise serializers.ValidationError(f'Quantity must be at most {MAX_QUANTITY}.')
+        return operations
+
+
+
 class CartListSerializer(serializers.ModelSerializer):
     cart_items = CartItemListSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -84,16 +163,28 @@ class CartListSerializer(serializers.ModelSerializer):
         fields = ['cart_items', 'total_price']
 
     def get_total_price(self, obj):
-        total_price = sum(item.product.price *
-                          item.quantity for item in obj.cart_items.all())
-        return total_price
+        if hasattr(obj, 'total'):
+            return obj.total or 0
+        return obj.cart_items.total()
+
+
+class OrderProductSerializer(serializers.ModelSerializer):
+    subtotal_price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderProduct
+        fields = ['product', 'quantity', 'unit_price', 'subtotal_price']
+
+    def get_subtotal_price(self, obj):
+        return obj.unit_price * obj.quantity if obj.unit_price is not None else None
 
 
-# class OrderProductSerializer(serializers.ModelSerializer):
-#     product=ProductListSerializer(read_only=True)
-#     class Meta:
-#         model=OrderProduct
-#         fields=['product','quantity']
+class OrderListSerializer(serializers.ModelSerializer):
+    products = OrderProductSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'total_price', 'status', 'address', 'zip_code', 'phone_number', 'created_at', 'products']
 
 
 class OrderCreateSerializer(serializers.Serializer):
@@ -103,44 +194,46 @@ class OrderCreateSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         user = self.context['request'].user
-        try:
-            cart = Cart.objects.get(user=user)
-        except Cart.DoesNotExist:
-            raise serializers.ValidationError("Your cart is empty.")
-        if not cart.cart_items.exists():
+        cart_items = list(
+            CartItem.objects.filter(cart__user_id=user.id).select_related('product')
+            .select_for_update(of=('self',)))
+        if not cart_items:
             raise serializers.ValidationError("Your cart is empty.")
+        attrs['cart_items'] = cart_items
         return attrs
 
     def create(self, validated_data):
+        ''' Must run inside the transaction that locked the cart lines in validate(). '''
         user = self.context['request'].user
-        cart = Cart.objects.get(user=user)
+        cart_items = validated_data['cart_items']
 
-        address = validated_data['address']
-        zip_code = validated_data['zip_code']
-        phone_number = validated_data['phone_number']
+        needed = {}
+        for item in cart_items:
+            needed[item.product_id] = needed.get(item.product_id, 0) + item.quantity - item.reserved_quantity
+        try:
+            adjust_stock(needed)
+        except InsufficientStock:
+            raise serializers.ValidationError('Not enough stock')
 
-        total_price = sum([
-            item.product.price * item.quantity
-            for item in cart.cart_items.all()
-        ])
+        total_price = sum(item.product.price * item.quantity for item in cart_items)
 
         order = Order.objects.create(
-            user=user,
+            user_id=user.id,
             total_price=total_price,
-            address=address,
-            zip_code=zip_code,
-            phone_number=phone_number,
+            address=validated_data['address'],
+            zip_code=validated_data['zip_code'],
+            phone_number=validated_data['phone_number'],
         )
 
-        for item in cart.cart_items.all():
-            OrderProduct.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-            )
-            item.product.sales_number += item.quantity
-            item.product.save()
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product_id=item.product_id, quantity=item.quantity,
+                         unit_price=item.product.price)
+            for item in cart_items
+        ])
+
+        CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
 
-        cart.cart_items.all().delete()
+        # Sales counters and best-seller boards are updated by a worker after commit.
+        jobs.enqueue('shopping.record_order_sales', {'order_id': order.id})
 
         return order
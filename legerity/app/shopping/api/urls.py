@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from shopping.api import views
+from shopping.api import async_views, views
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 router.register(r'cart-items', views.CartItemViewSet, basename='cart-item')
 
+if settings.ASYNC_CATALOG_VIEWS:
+    ReviewListView = async_views.AsyncReviewListView
+    ProductListView = async_views.AsyncProductListView
+    CategoryListView = async_views.AsyncCategoryListView
+else:
+    ReviewListView = views.ReviewListView
+    ProductListView = views.ProductListView
+    CategoryListView = views.CategoryListView
+
 urlpatterns = [
-    path('reviews/', views.ReviewListView.as_view(), name='reviews'),
-    path('products/', views.ProductListView.as_view(),name='products'),
-    path('category/', views.CategoryListView.as_view(),name='category'),
+    path('reviews/', ReviewListView.as_view(), name='reviews'),
+    path('products/', ProductListView.as_view(),name='products'),
+    path('products/bestsellers/', views.BestSellerView.as_view(), name='bestsellers'),
+    path('products/search/', views.ProductSearchView.as_view(), name='product-search'),
+    path('category/', CategoryListView.as_view(),name='category'),
+    path('catalog-cache/stats/', views.CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
+    path('analytics/sales/', views.SalesAnalyticsView.as_view(), name='sales-analytics'),
     path('checkout/', views.OrderView.as_view(),name='checkout'),
+    path('orders/', views.OrderListView.as_view(), name='orders'),
 ]
 
 urlpatterns += router.urls
\ No newline at end of file
@@ -1,41 +1,277 @@
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, GenericAPIView
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Prefetch, Sum, Value, When
 from django.shortcuts import get_object_or_404
-from shopping.models import Review, Product, Cart, CartItem, Category
-from shopping.api.serializers import ReviewListSerializer, CategoryListSerializer, ProductListSerializer, CartItemCreateSerializer, CartItemUpdateSerializer, CartListSerializer, OrderCreateSerializer
+from customer.authentication import USER_ID_AUTHENTICATION_CLASSES
+from shopping.models import Review, Product, Cart, CartItem, Category, Order, DailyCategorySales, DailyProductSales
+from shopping.api.mixins import CachedListMixin, ConditionalListMixin, StreamingListMixin
+from shopping.api.pagination import OrderHistoryPagination, ProductPagination, SearchPagination
+from shopping import leaderboard
+from shopping.cache import catalog_cache
+from shopping.search import search_products
+from shopping.stock import InsufficientStock, add_to_cart, adjust_stock, reservation_expiry, restore_stock
+from shopping.api.serializers import MAX_ID, MAX_QUANTITY, BestSellerFilterSerializer, SalesAnalyticsFilterSerializer, CartBatchSerializer, ProductFilterSerializer, ReviewListSerializer, CategoryListSerializer, ProductListSerializer, CartItemCreateSerializer, CartItemUpdateSerializer, CartListSerializer, OrderCreateSerializer, OrderListSerializer
 
 
-class ReviewListView(ListAPIView):
+class ReviewListView(ConditionalListMixin, StreamingListMixin, CachedListMixin, ListAPIView):
     queryset = Review.objects.all()
     serializer_class = ReviewListSerializer
+    cache_models = (Review,)
 
 
-class CategoryListView(ListAPIView):
+class CategoryListView(ConditionalListMixin, StreamingListMixin, CachedListMixin, ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryListSerializer
+    cache_models = (Category,)
 
 
-class ProductListView(ListAPIView):
-    queryset = Product.objects.all()
+class ProductListView(ConditionalListMixin, StreamingListMixin, CachedListMixin, ListAPIView):
+    ''' Products filtered by category, price range and availability.
+
+    With ``?facets=true`` the page also carries product counts per category and per
+    price bucket. Facets ignore the category and price filters so the client can show
+    every option, and are computed in one grouped query.
+    '''
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductListSerializer
+    pagination_class = ProductPagination
+    cache_models = (Product, Category)
+    price_buckets = (50, 100, 250, 500)
+    deferred_fields = ('info', 'info_html', 'search_vector')
+
+    def get_filters(self):
+        if not hasattr(self, '_filters'):
+            serializer = ProductFilterSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
+
+    def get_facet_queryset(self):
+        queryset = Product.objects.all()
+        if self.get_filters()['in_stock']:
+            queryset = queryset.filter(stock__gt=0)
+        return queryset
+
+    def get_queryset(self):
+        filters = self.get_filters()
+        queryset = self.get_facet_queryset().select_related('category').defer(*self.deferred_fields)
+        if 'category' in filters:
+            queryset = queryset.filter(category_id=filters['category'])
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+        return queryset
+
+    def get_facet_rows(self):
+        ''' One row per ``(category, price bucket)`` pair with its product count. '''
+        bucket = Case(
+            *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(self.price_buckets)],
+            default=Value(len(self.price_buckets)),
+            output_field=IntegerField(),
+        )
+        return (
+            self.get_facet_queryset()
+            .annotate(bucket=bucket)
+            .values('category_id', 'category__title', 'bucket')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+
+    def build_facets(self, rows):
+        bounds = (0,) + self.price_buckets + (None,)
+        categories, prices = {}, [0] * len(bounds[:-1])
+        for row in rows:
+            category = categories.setdefault(
+                row['category_id'], {'id': row['category_id'], 'title': row['category__title'], 'count': 0})
+            category['count'] += row['count']
+            prices[row['bucket']] += row['count']
+        return {
+            'categories': sorted(categories.values(), key=lambda category: category['id']),
+            'price': [
+                {'min': bounds[index], 'max': bounds[index + 1], 'count': count}
+                for index, count in enumerate(prices)
+            ],
+        }
+
+    def get_facets(self):
+        return self.build_facets(self.get_facet_rows())
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.get_filters()['facets']:
+            response.data['facets'] = self.get_facets()
+        return response
+
+
+class ProductSearchView(StreamingListMixin, CachedListMixin, ListAPIView):
+    serializer_class = ProductListSerializer
+    pagination_class = SearchPagination
+    cache_models = (Product, Category)
+    stream_ordering = ('-rank', 'id')
+
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        queryset = Product.objects.select_related('category').defer(*ProductListView.deferred_fields)
+        return search_products(queryset, text)
+
+
+class BestSellerView(APIView):
+
+    def get(self, request):
+        ''' Top products overall or in one category, all time or over a recent window. '''
+        filters = BestSellerFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        board = leaderboard.top(filters.validated_data['window'], filters.validated_data.get('category'))
+        products = Product.objects.select_related('category').in_bulk([product_id for product_id, _ in board])
+        data = [
+            {'units': units, 'product': ProductListSerializer(products[product_id], context={'request': request}).data}
+            for product_id, units in board if product_id in products
+        ]
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        ''' Hit/miss counters of this worker's catalog cache. '''
+        return Response(catalog_cache.stats(), status=status.HTTP_200_OK)
+
+
+class SalesAnalyticsView(APIView):
+    ''' Units, revenue and order counts over a day range, read from the daily rollups only.
+
+    ``group`` is ``day``, ``product`` or ``category``; ``product`` and ``category`` narrow
+    the figures to one product or category. Daily totals over all categories carry no
+    order count, because an order spanning several categories is counted in each.
+    '''
+    permission_classes = [IsAdminUser]
+    group_fields = {'day': 'day', 'product': 'product_id', 'category': 'category_id'}
+
+    def get(self, request):
+        filters = SalesAnalyticsFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        filters = filters.validated_data
+        group = filters['group']
+
+        by_product = group == 'product' or 'product' in filters
+        rows = (DailyProductSales if by_product else DailyCategorySales).objects.filter(
+            day__gte=filters['since'], day__lte=filters['until'])
+        if 'product' in filters:
+            rows = rows.filter(product_id=filters['product'])
+        if 'category' in filters:
+            rows = rows.filter(category_id=filters['category'])
+
+        field = self.group_fields[group]
+        rows = (
+            rows.values(field)
+            .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+            .order_by(field)
+        )
+        exact_orders = by_product or group == 'category' or 'category' in filters
+        results = [
+            {group: row[field], 'units': row['units'], 'revenue': row['revenue'],
+             'orders': row['orders'] if exact_orders else None}
+            for row in rows
+        ]
+        return Response({
+            'since': filters['since'], 'until': filters['until'], 'group': group, 'results': results,
+        }, status=status.HTTP_200_OK)
 
 
 class CartItemViewSet(viewsets.ViewSet):
+    authentication_classes = USER_ID_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
     def get_cart(self, request):
         ''' Retrieve or create the cart for the authenticated user. '''
-        cart, _ = Cart.objects.get_or_create(user=request.user)
+        cart, _ = Cart.objects.get_or_create(user_id=request.user.id)
         return cart
 
+    def get_cart_data(self, request):
+        ''' Serialized cart with SQL-side totals; never creates a cart. '''
+        cart = (
+            Cart.objects.filter(user_id=request.user.id)
+            .with_total()
+            .prefetch_related(Prefetch(
+                'cart_items',
+                queryset=CartItem.objects.select_related('product__category').with_subtotals().order_by('id'),
+            ))
+            .first()
+        )
+        if cart is None:
+            return {'cart_items': [], 'total_price': 0}
+        return CartListSerializer(cart).data
+
     def list(self, request):
         ''' Retrieve all products  in the user's cart. '''
-        cart = self.get_cart(request)
-        serializer = CartListSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(self.get_cart_data(request), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        ''' Apply a list of add/set/remove operations to the cart in one transaction. '''
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        with transaction.atomic():
+            cart = self.get_cart(request)
+            existing = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart)}
+
+            quantities = {product_id: item.quantity for product_id, item in existing.items()}
+            for operation in operations:
+                product_id = operation['product']
+                if operation['op'] == 'add':
+                    quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+                elif operation['op'] == 'set':
+                    quantities[product_id] = operation['quantity']
+                else:
+                    quantities.pop(product_id, None)
+            if any(quantity > MAX_QUANTITY for quantity in quantities.values()):
+                return Response({'error': f'Quantity must be at most {MAX_QUANTITY}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            touched = {operation['product'] for operation in operations}
+            deltas = {
+                product_id: quantities.get(product_id, 0) - (existing[product_id].reserved_quantity if product_id in existing else 0)
+                for product_id in touched
+            }
+            try:
+                adjust_stock(deltas)
+            except InsufficientStock:
+                stock = dict(Product.objects.filter(id__in=touched).values_list('id', 'stock'))
+                missing = sorted(product_id for product_id in touched if product_id not in stock and deltas[product_id] > 0)
+                if missing:
+                    return Response({'error': 'Product not found', 'products': missing}, status=status.HTTP_404_NOT_FOUND)
+                short = sorted(product_id for product_id, delta in deltas.items() if delta > stock.get(product_id, 0))
+                return Response({'error': 'Not enough stock', 'products': short}, status=status.HTTP_400_BAD_REQUEST)
+
+            reserved_until = reservation_expiry()
+            CartItem.objects.filter(id__in=[
+                item.id for product_id, item in existing.items() if product_id not in quantities
+            ]).delete()
+            updated = []
+            for product_id in touched & existing.keys() & quantities.keys():
+                item = existing[product_id]
+                item.quantity = item.reserved_quantity = quantities[product_id]
+                item.reserved_until = reserved_until
+                updated.append(item)
+            CartItem.objects.bulk_update(updated, ['quantity', 'reserved_quantity', 'reserved_until'])
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product_id, quantity=quantities[product_id],
+                         reserved_quantity=quantities[product_id], reserved_until=reserved_until)
+                for product_id in (touched & quantities.keys()) - existing.keys()
+            ])
+
+        return Response(self.get_cart_data(request), status=status.HTTP_200_OK)
 
     def create(self, request):
         cart = self.get_cart(request)
@@ -49,26 +285,39 @@ class CartItemViewSet(viewsets.ViewSet):
             return Response({'quantity': 'This field is required'}, status=status.HTTP_400_BAD_REQUEST)
     
         try:
-            product = Product.objects.get(id=product_id)
-        except Product.DoesNotExist:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            return Response({'error': 'Quantity must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if quantity < 1:
+            return Response({'error': 'Quantity must be at least 1.'}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity > MAX_QUANTITY:
+            return Response({'error': f'Quantity must be at most {MAX_QUANTITY}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
             return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-        if CartItem.objects.filter(cart=cart, product=product).exists():
-            return Response({'error': 'Product already in cart. Use PATCH to update quantity'}, status=status.HTTP_400_BAD_REQUEST)
-    
-        if int(quantity) > product.stock:
+        if not 0 < product_id <= MAX_ID:
+            return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        row = add_to_cart(cart.id, product_id, quantity)
+        if row is None:
+            if not Product.objects.filter(id=product_id).exists():
+                return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
             return Response({'error': 'Not enough stock'}, status=status.HTTP_400_BAD_REQUEST)
-    
-        cart_item = CartItem.objects.create(
-            cart=cart, product=product, quantity=quantity)
+
+        item_id, line_quantity, created = row
+        cart_item = CartItem(id=item_id, cart=cart, product_id=product_id, quantity=line_quantity)
         serializer = CartItemCreateSerializer(cart_item)
-    
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @transaction.atomic
     def partial_update(self, request, pk=None):
         ''' Update the quantity of an existing cart item (PATCH request). '''
         try:
-            cart_item = CartItem.objects.get(id=pk, cart__user=request.user)
+            cart_item = CartItem.objects.select_for_update().get(id=pk, cart__user_id=request.user.id)
         except CartItem.DoesNotExist:
             return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -78,31 +327,55 @@ class CartItemViewSet(viewsets.ViewSet):
 
         try:
             new_quantity = int(new_quantity)
-        except ValueError:
+        except (TypeError, ValueError):
             return Response({'error': 'Quantity must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if new_quantity > cart_item.product.stock:
+        if new_quantity < 1:
+            return Response({'error': 'Quantity must be at least 1.'}, status=status.HTTP_400_BAD_REQUEST)
+        if new_quantity > MAX_QUANTITY:
+            return Response({'error': f'Quantity must be at most {MAX_QUANTITY}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            adjust_stock({cart_item.product_id: new_quantity - cart_item.reserved_quantity})
+        except InsufficientStock:
             return Response({'error': 'Not enough stock'}, status=status.HTTP_400_BAD_REQUEST)
 
         cart_item.quantity = new_quantity
-        cart_item.save()
+        cart_item.reserved_quantity = new_quantity
+        cart_item.reserved_until = reservation_expiry()
+        cart_item.save(update_fields=['quantity', 'reserved_quantity', 'reserved_until'])
         serializer = CartItemUpdateSerializer(cart_item)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @transaction.atomic
     def destroy(self, request, pk=None):
-        ''' Remove an item from the cart (DELETE request). '''
+        ''' Remove an item from the cart (DELETE request) and release its reserved stock. '''
         try:
-            cart_item = CartItem.objects.get(id=pk, cart__user=request.user)
-            cart_item.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            cart_item = CartItem.objects.select_for_update().get(id=pk, cart__user_id=request.user.id)
         except CartItem.DoesNotExist:
             return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
+        restore_stock({cart_item.product_id: cart_item.reserved_quantity})
+        cart_item.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class OrderListView(ListAPIView):
+    ''' The user's past orders, newest first, with their price snapshots. '''
+    serializer_class = OrderListSerializer
+    pagination_class = OrderHistoryPagination
+    authentication_classes = USER_ID_AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Order.objects.filter(user_id=self.request.user.id).prefetch_related('products')
 
 
 class OrderView(GenericAPIView):
     serializer_class = OrderCreateSerializer
+    authentication_classes = USER_ID_AUTHENTICATION_CLASSES
     permission_classes = [IsAuthenticated]
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(
             data=request.data, context={'request': request})
@@ -0,0 +1,144 @@
+'''
+Versioned read-through cache for catalog responses.
+
+Every cached entry is keyed by the generation numbers of the models it was built
+from. Saving or deleting one of those models bumps its generation once the
+transaction commits (see ``shopping.signals``), so stale entries are never read again
+and simply age out of the bounded caches. Entries live in a per-process LRU, with a
+short TTL, in front of the ``catalog`` cache alias. Generations are read from that
+alias on every lookup, so it must be shared by every process that serves or changes
+the catalog: a file directory on a shared volume or a cache server. Local memory is
+only correct for a single process; ``shopping.checks`` refuses it where
+``CATALOG_CACHE_REQUIRE_SHARED`` is set.
+'''
+import hashlib
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from helpers.cache import LRUCache
+
+
+class CatalogCache:
+    alias = 'catalog'
+
+    def __init__(self, local_entries=None):
+        self.local = LRUCache(max_entries=local_entries or settings.CATALOG_CACHE_LOCAL_ENTRIES,
+                              ttl=settings.CATALOG_CACHE_LOCAL_TTL)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def is_process_local(self):
+        return isinstance(self.shared, LocMemCache)
+
+    def generation_key(self, model):
+        return f'catalog:gen:{model._meta.label_lower}'
+
+    def generations(self, models):
+        keys = [self.generation_key(model) for model in models]
+        found = self.shared.get_many(keys)
+        for key in keys:
+            if key not in found:
+                # Start from the clock so a re-created key never repeats an old generation.
+                self.shared.add(key, time.time_ns(), timeout=None)
+                found[key] = self.shared.get(key)
+        return [found[key] for key in keys]
+
+    async def agenerations(self, models):
+        keys = [self.generation_key(model) for model in models]
+        found = await self.shared.aget_many(keys)
+        for key in keys:
+            if key not in found:
+                await self.shared.aadd(key, time.time_ns(), timeout=None)
+                found[key] = await self.shared.aget(key)
+        return [found[key] for key in keys]
+
+    def bump(self, model):
+        ''' Move ``model`` to a new generation: the current time in nanoseconds.
+
+        A plain ``set`` rather than ``incr``, which is not atomic on file-based caches:
+        two concurrent bumps still leave a value that no entry was stored under.
+        '''
+        key = self.generation_key(model)
+        current = self.shared.get(key) or 0
+        self.shared.set(key, max(time.time_ns(), current + 1), timeout=None)
+
+    def bump_on_commit(self, model):
+        ''' Bump after the current transaction commits, so no request can cache the old
+        rows under the new generation; runs at once outside a transaction. '''
+        transaction.on_commit(partial(self.bump, model))
+
+    def make_key(self, models, request_key):
+        return self.data_key(self.generations(models), request_key)
+
+    def data_key(self, generations, request_key):
+        versions = ':'.join(str(generation) for generation in generations)
+        digest = hashlib.md5(f'{versions}|{request_key}'.encode()).hexdigest()
+        return f'catalog:data:{digest}'
+
+    def get(self, models, request_key):
+        ''' Return ``(key, data)``; ``data`` is ``None`` on a miss. '''
+        key = self.make_key(models, request_key)
+        data = self.local.get(key)
+        if data is not None:
+            self._count('local_hits')
+            return key, data
+        data = self.shared.get(key)
+        if data is not None:
+            self.local.set(key, data)
+            self._count('shared_hits')
+            return key, data
+        self._count('misses')
+        return key, None
+
+    async def aget(self, models, request_key):
+        ''' Async ``get`` for native async views; the local LRU is checked without awaiting. '''
+        key = self.data_key(await self.agenerations(models), request_key)
+        data = self.local.get(key)
+        if data is not None:
+            self._count('local_hits')
+            return key, data
+        data = await self.shared.aget(key)
+        if data is not None:
+            self.local.set(key, data)
+            self._count('shared_hits')
+            return key, data
+        self._count('misses')
+        return key, None
+
+    def set(self, key, data):
+        self.local.set(key, data)
+        self.shared.set(key, data)
+
+    async def aset(self, key, data):
+        self.local.set(key, data)
+        await self.shared.aset(key, data)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def reset_stats(self):
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def stats(self):
+        hits = self.counters['local_hits'] + self.counters['shared_hits']
+        lookups = hits + self.counters['misses']
+        return {
+            **self.counters,
+            'hit_ratio': round(hits / lookups, 4) if lookups else None,
+            'local_entries': len(self.local),
+            'backend': self.shared.__class__.__name__,
+        }
+
+
+catalog_cache = CatalogCache()
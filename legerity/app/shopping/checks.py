@@ -0,0 +1,22 @@
+'''
+System checks for the shopping app.
+'''
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from shopping.cache import catalog_cache
+
+
+@register(Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    ''' Generations and best-seller boards must be visible to every process. '''
+    if settings.CATALOG_CACHE_REQUIRE_SHARED and catalog_cache.is_process_local():
+        return [Error(
+            'The catalog cache uses local memory, so processes never see each other\'s '
+            'generation bumps or best-seller updates.',
+            hint='Set CATALOG_CACHE_BACKEND to a shared backend, e.g. '
+                 'django.core.cache.backends.filebased.FileBasedCache with CATALOG_CACHE_LOCATION '
+                 'on a volume mounted by the app and worker containers.',
+            id='shopping.E001',
+        )]
+    return []
@@ -0,0 +1,71 @@
+'''
+Sharded ``Product.sales_number`` counters.
+
+Checkouts add their quantities to one of ``SALES_COUNTER_SHARDS`` delta rows per
+product instead of updating the product row, so concurrent checkouts of a hot product
+(and admin edits of it) stop queueing on one row lock. ``fold`` moves the pending
+deltas into ``Product.sales_number`` and bumps the catalog generation, so cached
+pages ordered by sales follow; the ``shopping.fold_sales_counters`` job does that
+every ``FOLD_SALES_COUNTERS_INTERVAL`` seconds. ``exact_sales_numbers`` adds the
+pending deltas for reads that must be exact.
+'''
+import random
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+
+from shopping.cache import catalog_cache
+from shopping.models import Product, SalesCounterShard
+
+RECORD_SQL = '''
+INSERT INTO {table} (product_id, shard, delta) VALUES {values}
+ON CONFLICT (product_id, shard) DO UPDATE SET delta = {table}.delta + EXCLUDED.delta
+'''
+
+
+def record_sales(quantities):
+    ''' Add ``{product_id: quantity}`` to one randomly chosen shard per product. '''
+    quantities = sorted((product_id, quantity) for product_id, quantity in quantities.items() if quantity)
+    if not quantities:
+        return
+    shard = random.randrange(settings.SALES_COUNTER_SHARDS)
+    sql = RECORD_SQL.format(
+        table=SalesCounterShard._meta.db_table,
+        values=', '.join(['(%s, %s, %s)'] * len(quantities)),
+    )
+    params = [value for product_id, quantity in quantities for value in (product_id, shard, quantity)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def fold(batch_size=1000):
+    ''' Move one batch of pending deltas into ``Product.sales_number``; returns the rows folded. '''
+    with transaction.atomic():
+        shards = list(
+            SalesCounterShard.objects.select_for_update(skip_locked=True)
+            .order_by('product_id', 'shard')[:batch_size]
+        )
+        totals = {}
+        for shard in shards:
+            totals[shard.product_id] = totals.get(shard.product_id, 0) + shard.delta
+        totals = {product_id: delta for product_id, delta in totals.items() if delta}
+        if totals:
+            Product.objects.filter(id__in=totals).update(
+                sales_number=F('sales_number') + Case(
+                    *[When(id=product_id, then=Value(delta)) for product_id, delta in totals.items()],
+                    output_field=models.BigIntegerField(),
+                ),
+                updated_at=Now(),
+            )
+            catalog_cache.bump_on_commit(Product)
+        SalesCounterShard.objects.filter(id__in=[shard.id for shard in shards]).delete()
+    return len(shards)
+
+
+def exact_sales_numbers(product_ids):
+    ''' ``{product_id: sales_number + pending deltas}`` in one query. '''
+    rows = Product.objects.filter(id__in=product_ids).annotate(
+        pending=Coalesce(Sum('sales_shards__delta'), 0)).values_list('id', 'sales_number', 'pending')
+    return {product_id: sales_number + pending for product_id, sales_number, pending in rows}
@@ -0,0 +1,92 @@
+'''
+Streaming order exports for finance.
+
+Orders are read with a server-side cursor in ``chunk_size`` batches. The user comes in
+through a join and each batch's lines through one prefetch query. Rows are written as
+they are produced, so memory depends on the chunk size and not on the number of
+orders. The same generators feed the ``export_orders`` command (a file) and the admin
+action (a ``StreamingHttpResponse``).
+'''
+import csv
+
+from django.db.models import Prefetch
+from rest_framework.utils.encoders import JSONEncoder
+
+from shopping.models import Order, OrderProduct
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ORDER_COLUMNS = [
+    'order_id', 'created_at', 'status', 'user_id', 'email', 'fullname',
+    'total_price', 'address', 'zip_code', 'phone_number',
+]
+LINE_COLUMNS = ['product_id', 'quantity', 'unit_price']
+
+
+def export_queryset(queryset=None, since=None, until=None, status=None):
+    ''' Orders to export, oldest first; ``since`` is inclusive and ``until`` exclusive. '''
+    queryset = Order.objects.all() if queryset is None else queryset
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    if status:
+        queryset = queryset.filter(status=status)
+    return (
+        queryset.select_related('user')
+        .only(*[f.name for f in Order._meta.concrete_fields], 'user__email', 'user__fullname')
+        .prefetch_related(Prefetch(
+            'products', queryset=OrderProduct.objects.only('order_id', *LINE_COLUMNS).order_by('id')))
+        .order_by('id')
+    )
+
+
+def order_record(order):
+    return {
+        'order_id': order.id,
+        'created_at': order.created_at.isoformat(),
+        'status': order.status,
+        'user_id': order.user_id,
+        'email': order.user.email,
+        'fullname': order.user.fullname,
+        'total_price': order.total_price,
+        'address': order.address,
+        'zip_code': order.zip_code,
+        'phone_number': order.phone_number,
+        'lines': [
+            {'product_id': line.product_id, 'quantity': line.quantity, 'unit_price': line.unit_price}
+            for line in order.products.all()
+        ],
+    }
+
+
+class _Echo:
+    ''' File-like object whose ``write`` hands the line back instead of storing it. '''
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    ''' One CSV row per order line; an order without lines still gets one row. '''
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_COLUMNS + LINE_COLUMNS)
+    for record in records:
+        order = [record[column] for column in ORDER_COLUMNS]
+        for line in record['lines'] or [dict.fromkeys(LINE_COLUMNS, '')]:
+            yield writer.writerow(order + [line[column] for column in LINE_COLUMNS])
+
+
+def ndjson_lines(records):
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+def export_orders(queryset, format='csv', chunk_size=2000):
+    ''' Yield the export of ``queryset`` (see ``export_queryset``) as text chunks. '''
+    records = (order_record(order) for order in queryset.iterator(chunk_size=chunk_size))
+    return csv_lines(records) if format == 'csv' else ndjson_lines(records)
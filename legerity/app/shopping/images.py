@@ -0,0 +1,66 @@
+'''
+Product image derivatives (resized JPEG and WebP copies for ``srcset``).
+
+An upload made through the admin enqueues a ``shopping.generate_image_derivatives``
+job in the same transaction, so the admin save returns immediately and the job
+worker (``manage.py run_worker``) does the resizing; the variant names land in
+``Product.image_variants`` when it finishes. Web processes never start a process
+pool, which would not work under uWSGI, where ``sys.executable`` is not Python.
+``manage.py generate_image_derivatives`` backfills existing images in a pool.
+'''
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from helpers import jobs
+from helpers.images import generate_derivatives
+from shopping.cache import catalog_cache
+from shopping.models import Product
+
+
+def make_executor(workers=None):
+    return ProcessPoolExecutor(
+        max_workers=workers or settings.PRODUCT_IMAGE_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+def _arguments(product_id, image_name):
+    return (
+        default_storage.path(image_name),
+        str(settings.MEDIA_ROOT),
+        f'products/derivatives/{product_id}',
+        settings.PRODUCT_IMAGE_WIDTHS,
+    )
+
+
+def submit(pool, product):
+    return pool.submit(generate_derivatives, *_arguments(product.pk, product.image.name))
+
+
+def store_variants(product_id, image_name, variants):
+    ''' Save the variants unless the product's image changed in the meantime.
+
+    ``update`` skips ``auto_now``, so ``updated_at`` is set here; it feeds Last-Modified.
+    '''
+    return Product.objects.filter(id=product_id, image=image_name).update(
+        image_variants=variants, updated_at=timezone.now())
+
+
+def derive(product_id, image_name):
+    ''' Resize ``image_name`` in this process and store the variants if it is still current. '''
+    if store_variants(product_id, image_name, generate_derivatives(*_arguments(product_id, image_name))):
+        catalog_cache.bump_on_commit(Product)
+
+
+def schedule_derivatives(product):
+    ''' Enqueue the resizing of the product's image; call it in the transaction that saved it. '''
+    if not product.image:
+        Product.objects.filter(id=product.pk).update(image_variants={}, updated_at=timezone.now())
+        catalog_cache.bump_on_commit(Product)
+        return
+    jobs.enqueue('shopping.generate_image_derivatives',
+                 {'product_id': product.pk, 'image_name': product.image.name})
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from helpers.jobs import job
+from shopping import counters, images, leaderboard, rollups
+from shopping.models import OrderProduct
+from shopping.stock import release_expired
+
+
+@job('shopping.record_order_sales')
+def record_order_sales(order_id):
+    ''' Add an order's quantities to the sales counters, the best-seller boards and the daily rollups. '''
+    sold, products = {}, {}
+    for line in OrderProduct.objects.filter(order_id=order_id, product__isnull=False).select_related('product'):
+        sold[line.product_id] = sold.get(line.product_id, 0) + line.quantity
+        products[line.product_id] = line.product
+    counters.record_sales(sold)
+    rollups.sync([order_id])
+
+    # sales_number only moves when shards are folded; read it with the pending deltas.
+    totals = counters.exact_sales_numbers(sold)
+    lines = [
+        (product_id, products[product_id].category_id, quantity, totals[product_id])
+        for product_id, quantity in sold.items()
+    ]
+    transaction.on_commit(lambda: leaderboard.record_sales(lines))
+
+
+@job('shopping.release_reservations', every=timedelta(seconds=settings.RELEASE_RESERVATIONS_INTERVAL))
+def release_reservations(batch_size=500, max_batches=20):
+    ''' Return expired cart reservations to stock; the next run picks up any remainder. '''
+    for _ in range(max_batches):
+        if release_expired(batch_size=batch_size) < batch_size:
+            break
+
+
+@job('shopping.fold_sales_counters', every=timedelta(seconds=settings.FOLD_SALES_COUNTERS_INTERVAL))
+def fold_sales_counters(batch_size=1000, max_batches=20):
+    ''' Move pending counter shards into ``Product.sales_number``; see ``manage.py fold_sales_counters``. '''
+    for _ in range(max_batches):
+        if counters.fold(batch_size=batch_size) < batch_size:
+            break
+
+
+@job('shopping.generate_image_derivatives')
+def generate_image_derivatives(product_id, image_name):
+    ''' Resize a product image uploaded through the admin; see ``shopping.images``. '''
+    images.derive(product_id, image_name)
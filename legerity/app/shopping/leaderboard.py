@@ -0,0 +1,137 @@
+'''
+Best-seller leaderboards.
+
+Each board is a short ``[[product_id, units], ...]`` list, sorted best first, kept in
+the shared ``catalog`` cache per window (all time, last 7 and last 30 days) and per
+scope (all products or one category). Checkouts fold their lines into the touched
+boards after commit, so reads never sort the product table. A missing board is
+rebuilt from the database on first read. Boards expire ``BESTSELLERS_CACHE_TIMEOUT``
+seconds after they were built, however often sales update them, which bounds how
+long a board can drift from the database or keep sales that have slid out of its
+window; ``manage.py rebuild_bestsellers`` rebuilds all of them at once. The
+``catalog`` alias must be shared (see ``shopping.checks``), because the job worker
+updates the boards that the web processes read. Writers hold an advisory lock, so
+two workers folding sales at once do not overwrite each other's update, and boards
+are only built for categories that exist.
+'''
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from shopping.models import Category, Order, OrderProduct, Product
+
+LOCK_ID = 110011
+
+WINDOWS = {
+    'all': None,
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+
+def _cache():
+    return caches['catalog']
+
+
+def _lock():
+    ''' Serialize board writers until the surrounding transaction ends. '''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_ID])
+
+
+def board_key(window, category_id=None):
+    return f'bestsellers:v2:{window}:{category_id or "all"}'
+
+
+def _new_board(entries):
+    ''' Cache value of a freshly built board: its entries and when it must be rebuilt. '''
+    return {'expires': time.time() + settings.BESTSELLERS_CACHE_TIMEOUT, 'entries': entries}
+
+
+def _timeout(board):
+    return max(1, math.ceil(board['expires'] - time.time()))
+
+
+def _trim(units):
+    ranked = sorted(units.items(), key=lambda entry: (-entry[1], -entry[0]))
+    return [list(entry) for entry in ranked[:settings.BESTSELLERS_SIZE]]
+
+
+def compute_board(window, category_id=None):
+    ''' Build one board from the database. '''
+    size = settings.BESTSELLERS_SIZE
+    if WINDOWS[window] is None:
+        products = Product.objects.filter(sales_number__gt=0)
+        if category_id:
+            products = products.filter(category_id=category_id)
+        return [list(entry) for entry in
+                products.order_by('-sales_number', '-id').values_list('id', 'sales_number')[:size]]
+
+    lines = OrderProduct.objects.filter(
+        order__created_at__gte=timezone.now() - WINDOWS[window], product__isnull=False,
+    ).exclude(order__status=Order.OrderStatus.canceled)
+    if category_id:
+        lines = lines.filter(product__category_id=category_id)
+    rows = lines.values('product_id').annotate(units=Sum('quantity')).order_by('-units', '-product_id')[:size]
+    return [[row['product_id'], row['units']] for row in rows]
+
+
+def top(window='all', category_id=None):
+    key = board_key(window, category_id)
+    board = _cache().get(key)
+    if board is None:
+        if category_id and not Category.objects.filter(id=category_id).exists():
+            return []
+        board = _new_board(compute_board(window, category_id))
+        # add, not set: a board that record_sales or rebuild stored meanwhile is newer.
+        _cache().add(key, board, timeout=_timeout(board))
+    return board['entries']
+
+
+def record_sales(lines):
+    ''' Fold ``[(product_id, category_id, quantity, total_units), ...]`` into the boards.
+
+    ``total_units`` is the product's all-time count after the sale. All-time boards add
+    ``quantity`` to a product they already list, so two sales folded in either order
+    both count, and take ``total_units`` for a product that enters the board. Boards
+    that are not cached yet are left alone; they are built from the database when
+    first read.
+    '''
+    scopes = {}
+    for product_id, category_id, quantity, total_units in lines:
+        for scope in (None, category_id):
+            for window in WINDOWS:
+                scopes.setdefault(board_key(window, scope), []).append(
+                    (product_id, quantity, total_units if WINDOWS[window] is None else None))
+
+    with transaction.atomic():
+        _lock()
+        boards = _cache().get_many(list(scopes))
+        for key, board in boards.items():
+            units = dict(board['entries'])
+            for product_id, quantity, total_units in scopes[key]:
+                if total_units is not None and product_id not in units:
+                    units[product_id] = total_units
+                else:
+                    units[product_id] = units.get(product_id, 0) + quantity
+            board = {**board, 'entries': _trim(units)}
+            _cache().set(key, board, timeout=_timeout(board))
+
+
+def rebuild(window=None):
+    windows = [window] if window else list(WINDOWS)
+    scopes = [None] + list(Category.objects.values_list('id', flat=True))
+    for window in windows:
+        with transaction.atomic():
+            _lock()
+            _cache().set_many({
+                board_key(window, category_id): _new_board(compute_board(window, category_id))
+                for category_id in scopes
+            }, timeout=settings.BESTSELLERS_CACHE_TIMEOUT)
+    return len(windows) * len(scopes)
@@ -0,0 +1,35 @@
+'''
+Django command to fill OrderProduct.unit_price for lines written before it existed.
+'''
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from shopping.models import OrderProduct, Product
+
+
+class Command(BaseCommand):
+    ''' Django command to snapshot today's product price onto old order lines, in chunks.
+
+    The price at the time of those orders is not recorded anywhere, so the current price
+    is the best available value. Lines whose product was deleted stay empty.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        price = Subquery(Product.objects.filter(id=OuterRef('product_id')).values('price')[:1])
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                OrderProduct.objects.filter(id__gt=last_id, unit_price__isnull=True, product__isnull=False)
+                .order_by('id').values_list('id', flat=True)[:options['chunk_size']]
+            )
+            if not ids:
+                break
+            total += OrderProduct.objects.filter(id__in=ids).update(unit_price=price)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} order lines.'))
@@ -0,0 +1,64 @@
+'''
+Django command to compare checkout throughput on one hot product with direct and
+sharded sales_number updates.
+'''
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from shopping import counters
+from shopping.models import Category, Product
+
+
+class Command(BaseCommand):
+    ''' Django command to benchmark sales counter strategies against one hot product.
+
+    Every simulated checkout is a transaction that bumps the product's counter and then
+    spends ``--work-ms`` on the rest of its writes while still holding its locks. The
+    product and category it creates are deleted afterwards.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--checkouts', type=int, default=50, help='Checkouts per thread.')
+        parser.add_argument('--work-ms', type=float, default=5)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        category = Category.objects.create(title='bench')
+        product = Product.objects.create(category=category, info='', price=1, stock=0)
+        try:
+            for name, increment in (
+                ('direct', lambda: Product.objects.filter(id=product.id).update(sales_number=F('sales_number') + 1)),
+                ('sharded', lambda: counters.record_sales({product.id: 1})),
+            ):
+                elapsed = self.run(increment, options)
+                total = options['threads'] * options['checkouts']
+                self.stdout.write(f'{name:>8}: {total} checkouts in {elapsed:.2f}s ({total / elapsed:.1f}/s)')
+            while counters.fold():
+                pass
+            product.refresh_from_db()
+            self.stdout.write(self.style.SUCCESS(f'sales_number after folding: {product.sales_number}'))
+        finally:
+            category.delete()
+
+    def run(self, increment, options):
+        def worker():
+            try:
+                for _ in range(options['checkouts']):
+                    with transaction.atomic():
+                        increment()
+                        time.sleep(options['work_ms'] / 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
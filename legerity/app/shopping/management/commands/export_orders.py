@@ -0,0 +1,50 @@
+'''
+Django command to export orders with their lines as CSV or NDJSON.
+'''
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from shopping.exports import FORMATS, export_orders, export_queryset
+from shopping.models import Order
+
+
+def parse_moment(value):
+    ''' Accept ``YYYY-MM-DD`` (midnight, local time) or an ISO datetime. '''
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    ''' Django command to stream orders to a file or stdout with constant memory. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write; stdout when omitted.')
+        parser.add_argument('--since', type=parse_moment, help='Created at or after this date.')
+        parser.add_argument('--until', type=parse_moment, help='Created before this date.')
+        parser.add_argument('--status', choices=Order.OrderStatus.values)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        queryset = export_queryset(since=options['since'], until=options['until'], status=options['status'])
+        chunks = export_orders(queryset, format=options['format'], chunk_size=options['chunk_size'])
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(chunks)
+        self.stdout.write(self.style.SUCCESS(f'Exported orders to {options["output"]}.'))
@@ -0,0 +1,24 @@
+'''
+Django command to fold pending sales counter shards into Product.sales_number.
+'''
+from django.core.management.base import BaseCommand
+
+from shopping import counters
+
+
+class Command(BaseCommand):
+    ''' Django command to fold sharded sales counters in batches. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        total = 0
+        while True:
+            folded = counters.fold(batch_size=options['batch_size'])
+            total += folded
+            if folded < options['batch_size']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Folded {total} counter shards.'))
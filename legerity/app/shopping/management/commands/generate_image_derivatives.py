@@ -0,0 +1,42 @@
+'''
+Django command to create resized variants for existing product images.
+'''
+from django.core.management.base import BaseCommand
+
+from shopping.cache import catalog_cache
+from shopping.images import make_executor, store_variants, submit
+from shopping.models import Product
+
+
+class Command(BaseCommand):
+    ''' Django command to backfill ``Product.image_variants`` in chunks using a process pool. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument('--workers', type=int)
+        parser.add_argument('--force', action='store_true', help='Regenerate images that already have variants.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(image_variants={})
+
+        last_id = 0
+        total = failed = 0
+        with make_executor(options['workers']) as pool:
+            while True:
+                chunk = list(products.filter(id__gt=last_id).order_by('id').only('id', 'image')[:options['chunk_size']])
+                if not chunk:
+                    break
+                futures = [(product, submit(pool, product)) for product in chunk]
+                for product, future in futures:
+                    try:
+                        total += store_variants(product.id, product.image.name, future.result())
+                    except Exception as exc:
+                        failed += 1
+                        self.stderr.write(f'Product {product.id}: {exc}')
+                last_id = chunk[-1].id
+
+        catalog_cache.bump(Product)
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {total} products ({failed} failed).'))
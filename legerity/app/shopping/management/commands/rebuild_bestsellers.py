@@ -0,0 +1,18 @@
+'''
+Django command to rebuild the best-seller leaderboards from the database.
+'''
+from django.core.management.base import BaseCommand
+
+from shopping import leaderboard
+
+
+class Command(BaseCommand):
+    ''' Django command to recompute every best-seller board. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', choices=list(leaderboard.WINDOWS))
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        boards = leaderboard.rebuild(options['window'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {boards} best-seller boards.'))
@@ -0,0 +1,43 @@
+'''
+Django command to recompute the daily sales rollups for a range of days.
+'''
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shopping import rollups
+
+
+class Command(BaseCommand):
+    ''' Django command to rebuild and compact the daily rollups, one day per transaction.
+
+    Without arguments it covers yesterday and today, which is what the nightly run needs.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First day (YYYY-MM-DD).')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day, inclusive (YYYY-MM-DD).')
+        parser.add_argument('--all', action='store_true', help='Every day that has orders.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        today = timezone.localdate()
+        if options['all']:
+            since, until = rollups.order_days()
+            if since is None:
+                self.stdout.write(self.style.SUCCESS('No orders to roll up.'))
+                return
+        else:
+            until = options['until'] or today
+            since = options['since'] or min(until, today - timedelta(days=1))
+        if since > until:
+            raise CommandError('--since must not be after --until.')
+
+        day, rows = since, 0
+        while day <= until:
+            rows += rollups.rebuild_day(day)
+            day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt sales rollups for {(until - since).days + 1} days ({rows} product rows).'))
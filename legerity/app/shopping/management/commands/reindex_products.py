@@ -0,0 +1,39 @@
+'''
+Django command to rebuild product search vectors in small chunks.
+'''
+import time
+
+from django.core.management.base import BaseCommand
+
+from shopping.models import Product
+from shopping.search import refresh_id_range
+
+
+class Command(BaseCommand):
+    ''' Django command to backfill ``Product.search_vector`` without locking the table. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only fill products that have no search vector yet.')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between chunks.')
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:options['chunk_size']]
+            )
+            if not ids:
+                break
+            total += refresh_id_range(last_id, ids[-1], missing_only=options['missing_only'])
+            last_id = ids[-1]
+            self.stdout.write(f'Reindexed up to id {last_id}...')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {total} products.'))
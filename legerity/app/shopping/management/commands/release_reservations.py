@@ -0,0 +1,24 @@
+'''
+Django command to return expired cart reservations to stock.
+'''
+from django.core.management.base import BaseCommand
+
+from shopping.stock import release_expired
+
+
+class Command(BaseCommand):
+    ''' Django command to release expired stock reservations in batches. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        total = 0
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            total += released
+            if released < options['batch_size']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Released {total} reservations.'))
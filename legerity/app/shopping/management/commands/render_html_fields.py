@@ -0,0 +1,47 @@
+'''
+Django command to fill the stored renditions of product info and review comments.
+'''
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shopping.cache import catalog_cache
+from shopping.models import Product, Review
+
+RENDERED = (
+    (Product, 'render_info', ['info_html', 'info_excerpt', 'info_length']),
+    (Review, 'render_comment', ['comment_html', 'comment_excerpt', 'comment_length']),
+)
+
+
+class Command(BaseCommand):
+    ''' Django command to recompute sanitized HTML, excerpts and lengths in chunks. '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        ''' Entrypoint for command. '''
+        for model, render, fields in RENDERED:
+            source = fields[0].rsplit('_', 1)[0]
+            last_id = 0
+            total = 0
+            while True:
+                chunk = list(
+                    model.objects.filter(id__gt=last_id).order_by('id')
+                    .only('id', source)[:options['chunk_size']]
+                )
+                if not chunk:
+                    break
+                # bulk_update skips auto_now, so move updated_at (and Last-Modified) by hand.
+                now = timezone.now()
+                for instance in chunk:
+                    getattr(instance, render)()
+                    instance.updated_at = now
+                model.objects.bulk_update(chunk, [*fields, 'updated_at'])
+                last_id = chunk[-1].id
+                total += len(chunk)
+            # bulk_update sends no signals, so invalidate the cached lists by hand.
+            catalog_cache.bump(model)
+            self.stdout.write(f'Rendered {total} {model._meta.verbose_name_plural}.')
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:34
+
+from django.db import migrations, models, transaction
+
+MERGE_BATCH_SQL = '''
+WITH merged AS (
+    SELECT cart_id, product_id, MIN(id) AS keep_id, SUM(quantity) AS quantity,
+           SUM(reserved_quantity) AS reserved_quantity, MAX(reserved_until) AS reserved_until
+    FROM shopping_cartitem
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+    LIMIT %s
+), kept AS (
+    UPDATE shopping_cartitem AS item
+    SET quantity = merged.quantity,
+        reserved_quantity = merged.reserved_quantity,
+        reserved_until = merged.reserved_until
+    FROM merged
+    WHERE item.id = merged.keep_id
+    RETURNING item.id, item.cart_id, item.product_id
+)
+DELETE FROM shopping_cartitem AS item
+USING kept
+WHERE item.cart_id = kept.cart_id AND item.product_id = kept.product_id AND item.id <> kept.id
+'''
+
+
+def merge_duplicate_lines(apps, schema_editor, batch_size=1000):
+    ''' Fold duplicate (cart, product) lines into the oldest one, one committed batch at a time. '''
+    connection = schema_editor.connection
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(MERGE_BATCH_SQL, [batch_size])
+            if cursor.rowcount == 0:
+                break
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('shopping', '0010_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 07:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0013_product_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.SmallIntegerField()),
+                ('delta', models.BigIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_shards', to='shopping.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='salescountershard',
+            constraint=models.UniqueConstraint(fields=('product', 'shard'), name='unique_product_shard'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:10
+
+from django.conf import settings
+from django.db import migrations, transaction
+from django.utils import timezone
+
+from helpers.html import render_html
+
+RENDERED = (
+    ('Product', 'info'),
+    ('Review', 'comment'),
+)
+
+
+def render_existing_rows(apps, schema_editor, batch_size=500):
+    ''' Fill the renditions added in 0016 for rows saved before it, one committed batch at a time. '''
+    alias = schema_editor.connection.alias
+    for model_name, source in RENDERED:
+        model = apps.get_model('shopping', model_name)
+        fields = [f'{source}_html', f'{source}_excerpt', f'{source}_length', 'updated_at']
+        last_id = 0
+        while True:
+            with transaction.atomic(using=alias):
+                chunk = list(
+                    model.objects.using(alias).filter(id__gt=last_id).order_by('id')
+                    .only('id', source)[:batch_size]
+                )
+                if not chunk:
+                    break
+                now = timezone.now()
+                for instance in chunk:
+                    rendered = render_html(getattr(instance, source), settings.HTML_EXCERPT_LENGTH)
+                    for field, value in zip(fields, (*rendered, now)):
+                        setattr(instance, field, value)
+                model.objects.using(alias).bulk_update(chunk, fields)
+            last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('shopping', '0019_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:12
+
+from django.conf import settings
+from django.db import migrations, transaction
+
+BACKFILL_SQL = '''
+UPDATE shopping_product AS product
+SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(category.title, '')), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig,
+                          regexp_replace(coalesce(product.info, ''), '<[^>]*>', ' ', 'g')), 'B')
+FROM shopping_category AS category
+WHERE category.id = product.category_id AND product.id > %(start)s AND product.id <= %(end)s
+  AND product.search_vector IS NULL
+'''
+
+
+def fill_search_vectors(apps, schema_editor, batch_size=1000):
+    ''' Index the products that existed before 0012, one committed id range at a time. '''
+    Product = apps.get_model('shopping', 'Product')
+    connection = schema_editor.connection
+    last_id = 0
+    while True:
+        ids = list(
+            Product.objects.using(connection.alias).filter(id__gt=last_id).order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(BACKFILL_SQL, {'config': settings.SEARCH_CONFIG, 'start': last_id, 'end': ids[-1]})
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('shopping', '0020_render_existing_html_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,19 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from customer.models import User
 from tinymce.models import HTMLField
+from django.conf import settings
+from helpers.html import render_html
 
 # Create your models here. 
 
+def _with_rendered(update_fields, source, targets):
+    if update_fields is not None and source in update_fields:
+        return {*update_fields, *targets}
+    return update_fields
+
+
 class About(models.Model):
     number_of_personals=models.BigIntegerField(default=0)
     satisfaction_percent=models.IntegerField()
@@ -15,15 +25,30 @@ class Review(models.Model):
     fullname = models.CharField(max_length=255, null=True)
     image = models.CharField(max_length=255, null=True)
     comment = HTMLField(null=True)
+    comment_html = models.TextField(blank=True, default='', editable=False)
+    comment_excerpt = models.CharField(max_length=255, blank=True, default='', editable=False)
+    comment_length = models.IntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
 
     def __str__(self):
         return self.fullname
 
+    def render_comment(self):
+        self.comment_html, self.comment_excerpt, self.comment_length = render_html(
+            self.comment, settings.HTML_EXCERPT_LENGTH)
+
+    def save(self, *args, **kwargs):
+        self.render_comment()
+        kwargs['update_fields'] = _with_rendered(
+            kwargs.get('update_fields'), 'comment', ('comment_html', 'comment_excerpt', 'comment_length'))
+        super().save(*args, **kwargs)
+
 
 
 class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
     title= models.CharField(max_length=50)
 
     def __str__(self):
@@ -33,10 +58,16 @@ class Category(models.Model):
 class Product(models.Model):
     category=models.ForeignKey(Category,on_delete=models.CASCADE,related_name='products', db_index=True)
     info=HTMLField(null=True)
+    info_html=models.TextField(blank=True, default='', editable=False)
+    info_excerpt=models.CharField(max_length=255, blank=True, default='', editable=False)
+    info_length=models.IntegerField(default=0, editable=False)
     price=models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
     stock=models.IntegerField(db_index=True)
     sales_number=models.BigIntegerField(db_index=True,default=0)
     image = models.ImageField('Product Image', upload_to='products',null=True,blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         indexes = [
@@ -44,12 +75,69 @@ class Product(models.Model):
             models.Index(fields=['stock'],name='stock_idx'),
             models.Index(fields=['category'],name='category_idx'),
             models.Index(fields=['sales_number'],name='sales_idx'),
+            models.Index(fields=['price', 'id'], name='price_id_idx'),
+            models.Index(fields=['sales_number', 'id'], name='sales_id_idx'),
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            GinIndex(fields=['search_vector'], name='product_search_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='category_price_idx'),
+            models.Index(fields=['category', 'sales_number', 'id'], name='category_sales_idx'),
+            models.Index(fields=['price', 'id'], name='in_stock_price_idx', condition=models.Q(stock__gt=0)),
+            models.Index(fields=['sales_number', 'id'], name='in_stock_sales_idx', condition=models.Q(stock__gt=0)),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(stock__gte=0), name='stock_non_negative'),
         ]
+
+    def render_info(self):
+        self.info_html, self.info_excerpt, self.info_length = render_html(
+            self.info, settings.HTML_EXCERPT_LENGTH)
+
+    def save(self, *args, **kwargs):
+        self.render_info()
+        kwargs['update_fields'] = _with_rendered(
+            kwargs.get('update_fields'), 'info', ('info_html', 'info_excerpt', 'info_length'))
+        super().save(*args, **kwargs)
    
 
+class SalesCounterShard(models.Model):
+    ''' Pending increments of ``Product.sales_number``, spread over a few rows per product. '''
+    product=models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_shards')
+    shard=models.SmallIntegerField()
+    delta=models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='unique_product_shard'),
+        ]
+
+
+def _line_total(prefix=''):
+    return models.ExpressionWrapper(
+        models.F(f'{prefix}product__price') * models.F(f'{prefix}quantity'),
+        output_field=models.DecimalField(max_digits=20, decimal_places=2),
+    )
+
+
+class CartQuerySet(models.QuerySet):
+    def with_total(self):
+        ''' Annotate ``total`` (sum of price * quantity over the lines) in SQL. '''
+        return self.annotate(total=models.Sum(_line_total('cart_items__')))
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        ''' Annotate ``subtotal`` (price * quantity) in SQL. '''
+        return self.annotate(subtotal=_line_total())
+
+    def total(self):
+        return self.aggregate(total=models.Sum(_line_total()))['total'] or 0
+
+
 class Cart(models.Model):
     user=models.OneToOneField(User, on_delete=models.CASCADE, related_name='carts', db_index=True)
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['user'], name='cart_user'),
@@ -62,10 +150,19 @@ class CartItem(models.Model):
     cart=models.ForeignKey(Cart,on_delete=models.CASCADE,related_name="cart_items", db_index=True)
     product=models.ForeignKey(Product, on_delete=models.CASCADE, related_name='products')
     quantity=models.IntegerField()
+    reserved_quantity=models.IntegerField(default=0)
+    reserved_until=models.DateTimeField(null=True, blank=True)
+
+    objects = CartItemQuerySet.as_manager()
 
     class Meta:
         indexes = [
             models.Index(fields=['cart'],name='cart_idx'),
+            models.Index(fields=['reserved_until'], name='reserved_until_idx',
+                         condition=models.Q(reserved_quantity__gt=0)),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
         ]
 
     @property
@@ -86,12 +183,17 @@ class Order(models.Model):
     phone_number=models.BigIntegerField( db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField('Status',max_length=10, choices=OrderStatus.choices, default=OrderStatus.prepared, db_index=True)    
+    # Whether the lines are currently counted in the daily sales rollups (see shopping/rollups.py)
+    in_rollups = models.BooleanField(default=False, editable=False)
 
     class Meta:
         indexes = [
             models.Index(fields=['phone_number'],name='phone_idx'),
             models.Index(fields=['status']),
             models.Index(fields=['user'],name='user_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='user_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='status_created_idx'),
         ]
 
 
@@ -99,6 +201,7 @@ class OrderProduct(models.Model):
     order=models.ForeignKey(Order, on_delete=models.CASCADE, related_name='products', db_index=True)
     product=models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     quantity=models.IntegerField()
+    unit_price=models.DecimalField(max_digits=10, decimal_places=2, null=True)
 
     class Meta:
         indexes = [
@@ -106,3 +209,36 @@ class OrderProduct(models.Model):
         ]
 
 
+class DailyProductSales(models.Model):
+    ''' Units, revenue and order count of one product on one day, excluding canceled orders. '''
+    day=models.DateField()
+    # No database constraint, so deleting a product keeps its sales history.
+    product=models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    units=models.BigIntegerField(default=0)
+    revenue=models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders=models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_day_product'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='product_day_idx'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    ''' Units, revenue and order count of one category on one day, excluding canceled orders. '''
+    day=models.DateField()
+    category=models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    units=models.BigIntegerField(default=0)
+    revenue=models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders=models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_day_category'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'day'], name='category_day_idx'),
+        ]
@@ -0,0 +1,132 @@
+'''
+Daily sales rollups per product and per category.
+
+``DailyProductSales`` and ``DailyCategorySales`` hold units, revenue and order count
+per local day, so reports never aggregate ``Order``/``OrderProduct``. Canceled orders
+are not counted. ``Order.in_rollups`` records whether an order's lines are counted
+now. ``sync`` compares that flag with the order's status and adds or subtracts the
+difference, so calling it twice for the same order is harmless. The order job runs it
+after checkout and ``shopping.signals`` runs it on every later save.
+
+``rebuild_day`` recomputes a whole day from the orders and re-aligns the flags. It also
+drops rows that incremental updates brought down to zero. Run
+``manage.py rebuild_sales_rollups`` nightly. Incremental updates take a shared
+advisory lock and rebuilds an exclusive one, so the two never interleave.
+'''
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from shopping.models import DailyCategorySales, DailyProductSales, Order, OrderProduct, Product
+
+LOCK_ID = 230023
+
+# {orders} must select (id, created_at, sign) for the orders whose lines are added
+# (sign 1) or subtracted (sign -1).
+APPLY_SQL = '''
+WITH changed AS (
+    {orders}
+),
+lines AS (
+    SELECT (o.created_at AT TIME ZONE %(tz)s)::date AS day, o.id AS order_id, o.sign,
+           l.product_id, p.category_id,
+           SUM(l.quantity) AS units,
+           SUM(l.quantity * COALESCE(l.unit_price, p.price)) AS revenue
+    FROM changed o
+    JOIN {line} l ON l.order_id = o.id
+    JOIN {product} p ON p.id = l.product_id
+    WHERE o.sign <> 0
+    GROUP BY 1, 2, 3, 4, 5
+),
+by_product AS (
+    INSERT INTO {product_sales} AS t (day, product_id, units, revenue, orders)
+    SELECT day, product_id, SUM(sign * units), SUM(sign * revenue), SUM(sign)
+    FROM lines GROUP BY day, product_id
+    ON CONFLICT (day, product_id) DO UPDATE SET
+        units = t.units + EXCLUDED.units,
+        revenue = t.revenue + EXCLUDED.revenue,
+        orders = t.orders + EXCLUDED.orders
+    RETURNING 1
+),
+per_category AS (
+    SELECT day, category_id, order_id, sign, SUM(units) AS units, SUM(revenue) AS revenue
+    FROM lines GROUP BY day, category_id, order_id, sign
+)
+INSERT INTO {category_sales} AS t (day, category_id, units, revenue, orders)
+SELECT day, category_id, SUM(sign * units), SUM(sign * revenue), SUM(sign)
+FROM per_category GROUP BY day, category_id
+ON CONFLICT (day, category_id) DO UPDATE SET
+    units = t.units + EXCLUDED.units,
+    revenue = t.revenue + EXCLUDED.revenue,
+    orders = t.orders + EXCLUDED.orders
+'''
+
+SYNC_ORDERS = '''
+    UPDATE {order} SET in_rollups = (status <> %(canceled)s AND %(keep)s)
+    WHERE id = ANY(%(ids)s) AND in_rollups <> (status <> %(canceled)s AND %(keep)s)
+    RETURNING id, created_at, CASE WHEN in_rollups THEN 1 ELSE -1 END AS sign
+'''
+
+# Counting the day's orders and re-aligning their flags is one statement, so an order
+# that commits meanwhile is either counted and flagged or neither.
+REBUILD_ORDERS = '''
+    UPDATE {order} SET in_rollups = (status <> %(canceled)s)
+    WHERE created_at >= %(start)s AND created_at < %(end)s
+    RETURNING id, created_at, CASE WHEN in_rollups THEN 1 ELSE 0 END AS sign
+'''
+
+TABLES = {
+    'order': Order._meta.db_table,
+    'line': OrderProduct._meta.db_table,
+    'product': Product._meta.db_table,
+    'product_sales': DailyProductSales._meta.db_table,
+    'category_sales': DailyCategorySales._meta.db_table,
+}
+
+
+def _apply(cursor, orders, params):
+    sql = APPLY_SQL.format(orders=orders.format(**TABLES), **TABLES)
+    cursor.execute(sql, {'tz': settings.TIME_ZONE, 'canceled': Order.OrderStatus.canceled, **params})
+
+
+def sync(order_ids, keep=True):
+    ''' Bring the rollups in line with the current status of ``order_ids``.
+
+    With ``keep=False`` the orders are taken out of the rollups whatever their status;
+    this is for orders about to be deleted.
+    '''
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock_shared(%s)', [LOCK_ID])
+        _apply(cursor, SYNC_ORDERS, {'ids': order_ids, 'keep': keep})
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def rebuild_day(day):
+    ''' Recompute one local day from the orders; returns the number of product rows. '''
+    start, end = day_bounds(day)
+    params = {'start': start, 'end': end}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_ID])
+        DailyProductSales.objects.filter(day=day).delete()
+        DailyCategorySales.objects.filter(day=day).delete()
+        _apply(cursor, REBUILD_ORDERS, params)
+    return DailyProductSales.objects.filter(day=day).count()
+
+
+def order_days():
+    ''' First and last local day with orders, or ``(None, None)``. '''
+    first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    last = Order.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+    if first is None:
+        return None, None
+    return timezone.localdate(first), timezone.localdate(last)
+
@@ -0,0 +1,55 @@
+'''
+Full-text search over products.
+
+``Product.search_vector`` stores the category title (weight A) and the product info
+with its HTML stripped (weight B). It is refreshed by signals when a product or
+category is saved and can be backfilled in chunks with ``manage.py reindex_products``.
+'''
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from shopping.models import Category, Product
+
+REFRESH_SQL = '''
+UPDATE {product} AS product
+SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(category.title, '')), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig,
+                          regexp_replace(coalesce(product.info, ''), '<[^>]*>', ' ', 'g')), 'B')
+FROM {category} AS category
+WHERE category.id = product.category_id AND {condition}
+'''
+
+
+def _refresh(condition, params):
+    sql = REFRESH_SQL.format(
+        product=Product._meta.db_table, category=Category._meta.db_table, condition=condition)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'config': settings.SEARCH_CONFIG, **params})
+        return cursor.rowcount
+
+
+def refresh_products(product_ids):
+    return _refresh('product.id = ANY(%(ids)s)', {'ids': list(product_ids)})
+
+
+def refresh_category(category_id):
+    return _refresh('product.category_id = %(category)s', {'category': category_id})
+
+
+def refresh_id_range(start, end, missing_only=False):
+    ''' Refresh products with ``start < id <= end``. '''
+    condition = 'product.id > %(start)s AND product.id <= %(end)s'
+    if missing_only:
+        condition += ' AND product.search_vector IS NULL'
+    return _refresh(condition, {'start': start, 'end': end})
+
+
+def search_products(queryset, text):
+    query = SearchQuery(text, search_type='websearch', config=settings.SEARCH_CONFIG)
+    # ts_rank returns a real; cast it so cursor positions round-trip exactly.
+    return queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from shopping import rollups, search
+from shopping.cache import catalog_cache
+from shopping.models import Category, Order, Product, Review
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Review)
+def bump_catalog_generation(sender, **kwargs):
+    catalog_cache.bump_on_commit(sender)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_vector(sender, instance, **kwargs):
+    search.refresh_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        search.refresh_category(instance.pk)
+
+
+@receiver(post_save, sender=Order)
+def sync_order_rollups(sender, instance, created, **kwargs):
+    # New orders are added by the shopping.record_order_sales job after checkout.
+    if not created:
+        rollups.sync([instance.pk])
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_from_rollups(sender, instance, **kwargs):
+    if instance.in_rollups:
+        rollups.sync([instance.pk], keep=False)
@@ -0,0 +1,131 @@
+'''
+Stock reservation helpers.
+
+Stock is taken from ``Product.stock`` with conditional ``UPDATE ... WHERE stock >= n``
+statements, so two concurrent requests can never both get the last unit. Cart lines
+hold what they took in ``CartItem.reserved_quantity`` until ``reserved_until``; after
+that ``release_expired`` hands the units back to the product.
+
+These raw updates send no signals, so whenever a product runs out of stock or comes
+back in stock they bump the ``Product`` catalog generation themselves; otherwise
+cached ``?in_stock=true`` lists and their validators would never change.
+'''
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from shopping.cache import catalog_cache
+from shopping.models import CartItem, Product
+
+
+class InsufficientStock(Exception):
+    ''' Raised when at least one product cannot cover the requested quantity. '''
+
+
+# Both return (id, stock before, stock after) for every updated product.
+TAKE_STOCK_SQL = '''
+UPDATE {product} AS product SET stock = product.stock - line.quantity
+FROM unnest(%(ids)s::bigint[], %(quantities)s::integer[]) AS line(id, quantity)
+WHERE product.id = line.id AND product.stock >= line.quantity
+RETURNING product.id, product.stock + line.quantity, product.stock
+'''.format(product=Product._meta.db_table)
+
+RESTORE_STOCK_SQL = '''
+UPDATE {product} AS product SET stock = product.stock + line.quantity
+FROM unnest(%(ids)s::bigint[], %(quantities)s::integer[]) AS line(id, quantity)
+WHERE product.id = line.id
+RETURNING product.id, product.stock - line.quantity, product.stock
+'''.format(product=Product._meta.db_table)
+
+
+def _update_stock(sql, quantities):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'ids': list(quantities), 'quantities': list(quantities.values())})
+        rows = cursor.fetchall()
+    if any((before > 0) != (after > 0) for _, before, after in rows):
+        catalog_cache.bump_on_commit(Product)
+    return rows
+
+
+def take_stock(quantities):
+    ''' Atomically remove ``{product_id: quantity}`` from stock, all or nothing. '''
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    with transaction.atomic():
+        if len(_update_stock(TAKE_STOCK_SQL, quantities)) != len(quantities):
+            raise InsufficientStock()
+
+
+def restore_stock(quantities):
+    ''' Give ``{product_id: quantity}`` back to stock. '''
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if quantities:
+        _update_stock(RESTORE_STOCK_SQL, quantities)
+
+
+def adjust_stock(deltas):
+    ''' Take positive deltas and restore negative ones in ``{product_id: delta}``. '''
+    with transaction.atomic():
+        take_stock({product_id: delta for product_id, delta in deltas.items() if delta > 0})
+        restore_stock({product_id: -delta for product_id, delta in deltas.items() if delta < 0})
+
+
+ADD_TO_CART_SQL = '''
+WITH taken AS (
+    UPDATE {product} SET stock = stock - %(quantity)s
+    WHERE id = %(product)s AND stock >= %(quantity)s
+    RETURNING id, stock
+),
+line AS (
+    INSERT INTO {item} (cart_id, product_id, quantity, reserved_quantity, reserved_until)
+    SELECT %(cart)s, taken.id, %(quantity)s, %(quantity)s, %(until)s FROM taken
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET
+        quantity = {item}.quantity + EXCLUDED.quantity,
+        reserved_quantity = {item}.reserved_quantity + EXCLUDED.reserved_quantity,
+        reserved_until = EXCLUDED.reserved_until
+    RETURNING id, quantity, (xmax = 0) AS created
+)
+SELECT line.id, line.quantity, line.created, taken.stock FROM line, taken
+'''.format(product=Product._meta.db_table, item=CartItem._meta.db_table)
+
+
+def add_to_cart(cart_id, product_id, quantity):
+    ''' Reserve stock and insert or grow the cart line in a single statement.
+
+    Returns ``(item_id, line_quantity, created)``, or ``None`` when the product is
+    missing or cannot cover ``quantity``.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_TO_CART_SQL, {
+            'cart': cart_id, 'product': product_id, 'quantity': quantity, 'until': reservation_expiry(),
+        })
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[3] == 0:
+        catalog_cache.bump_on_commit(Product)
+    return row[:3]
+
+
+def reservation_expiry():
+    return timezone.now() + settings.STOCK_RESERVATION_TTL
+
+
+def release_expired(batch_size=500, now=None):
+    ''' Return one batch of expired reservations to stock; returns the number of lines released. '''
+    now = now or timezone.now()
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.select_for_update(skip_locked=True)
+            .filter(reserved_quantity__gt=0, reserved_until__lt=now)
+            .order_by('reserved_until')
+            .only('id', 'product_id', 'reserved_quantity')[:batch_size]
+        )
+        released = {}
+        for item in items:
+            released[item.product_id] = released.get(item.product_id, 0) + item.reserved_quantity
+        restore_stock(released)
+        CartItem.objects.filter(id__in=[item.id for item in items]).update(
+            reserved_quantity=0, reserved_until=None)
+    return len(items)
@@ -1,10 +1,43 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient,APITestCase
 from rest_framework import status
 from .models import Product, Category,Cart, CartItem,Order,OrderProduct,User
 from shopping.api.serializers import ProductListSerializer,CartItemCreateSerializer,CartItemUpdateSerializer,CartListSerializer
 from rest_framework.authtoken.models import Token
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TransactionTestCase
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from shopping.images import schedule_derivatives
+from shopping.stock import add_to_cart, release_expired, restore_stock, take_stock
+from shopping.cache import catalog_cache
+from shopping.checks import check_catalog_cache
+from shopping.api.async_views import AsyncCategoryListView, AsyncProductListView
+import csv
+import importlib
+from django.apps import apps as django_apps
+import json
+from rest_framework.utils.encoders import JSONEncoder
+from shopping import counters, leaderboard
+from shopping.counters import exact_sales_numbers
+from shopping.models import DailyCategorySales, DailyProductSales, SalesCounterShard
+from helpers import jobs
+from helpers.models import Job
+import os
+import sys
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.core.files.base import ContentFile
+import threading
+import time
+from unittest import mock
 
 # Create your tests here.
 
@@ -12,14 +45,15 @@ class ProductListViewTest(TestCase):
     def setUp(self):
         self.client = APIClient()
 
-        self.category = Category.objects.create(title="shoes")
-        self.product = Product.objects.create(
-            category=self.category,
-            info="<p>new shoes</p>",
-            price=100.99,
-            stock=5,
-            sales_number=1,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(title="shoes")
+            self.product = Product.objects.create(
+                category=self.category,
+                info="<p>new shoes</p>",
+                price=100.99,
+                stock=5,
+                sales_number=1,
+            )
         self.url = reverse('products')
 
     def test_product_list(self):
@@ -27,17 +61,305 @@ class ProductListViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         expected_data = ProductListSerializer([self.product], many=True).data
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['results'], expected_data)
 
     def test_product_list_fields(self):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        product = response.data[0]
+        product = response.data['results'][0]
 
         expected_fields = ['id', 'name', 'info', 'price', 'image', 'category']
         for field in expected_fields:
             self.assertIn(field, product)
 
+    def test_product_list_sends_info_excerpt(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['info'], 'new shoes')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.info_html, self.product.info_length), ('<p>new shoes</p>', 9))
+
+        Product.objects.update(info_excerpt='')
+        before = Product.objects.get(id=self.product.id).updated_at
+        call_command('render_html_fields', stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).data['results'][0]['info'], 'new shoes')
+        self.assertGreater(Product.objects.get(id=self.product.id).updated_at, before)
+
+        Product.objects.update(info_html='', info_excerpt='', info_length=0)
+        migration = importlib.import_module('shopping.migrations.0020_render_existing_html_fields')
+        migration.render_existing_rows(django_apps, mock.Mock(connection=connection))
+        self.assertEqual(Product.objects.values_list('info_html', 'info_excerpt', 'info_length').get(),
+                         ('<p>new shoes</p>', 'new shoes', 9))
+
+    def test_product_image_derivatives(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            buffer = BytesIO()
+            Image.new('RGB', (800, 400), 'red').save(buffer, 'PNG')
+            self.product.image.save('shoe.png', ContentFile(buffer.getvalue()))
+
+            before = Product.objects.get(id=self.product.id).updated_at
+            call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+            self.product.refresh_from_db()
+            self.assertGreater(self.product.updated_at, before)
+            self.assertEqual(sorted(self.product.image_variants, key=int), ['320', '640', '800'])
+            with Image.open(os.path.join(media_root, self.product.image_variants['320']['webp'])) as image:
+                self.assertEqual(image.size, (320, 160))
+
+            srcset = self.client.get(self.url).data['results'][0]['image_srcset']
+            self.assertTrue(srcset['640']['jpeg'].startswith('http://testserver/static/media/products/derivatives/'))
+
+    def test_admin_upload_resized_by_worker(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            buffer = BytesIO()
+            Image.new('RGB', (800, 400), 'red').save(buffer, 'PNG')
+            self.product.image.save('shoe.png', ContentFile(buffer.getvalue()))
+            schedule_derivatives(self.product)
+            self.assertEqual(Job.objects.get().payload,
+                             {'product_id': self.product.id, 'image_name': self.product.image.name})
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(jobs.work(), 1)
+            self.product.refresh_from_db()
+            self.assertEqual(sorted(self.product.image_variants, key=int), ['320', '640', '800'])
+            self.assertIn('640', self.client.get(self.url).data['results'][0]['image_srcset'])
+
+    def test_product_list_keyset_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for price in (10, 20, 20, 30, 40):
+                Product.objects.create(category=self.category, info='', price=price, stock=1)
+        expected = list(Product.objects.order_by('-price', '-id').values_list('id', flat=True))
+
+        self.client.get(self.url)  # warm the list validators
+        seen = []
+        url = self.url + '?ordering=-price&page_size=2'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [product['id'] for product in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(self.url + '?ordering=-price&page_size=2')
+        response = self.client.get(self.client.get(response.data['next']).data['previous'])
+        self.assertEqual([product['id'] for product in response.data['results']], expected[:2])
+
+    def test_product_list_cached_until_catalog_changes(self):
+        self.client.get(self.url)
+        catalog_cache.reset_stats()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(catalog_cache.stats()['misses'], 0)
+
+        self.category.title = 'boots'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'boots')
+
+    def test_catalog_generation_bumps_after_commit(self):
+        generations = catalog_cache.generations([Product])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+            self.assertEqual(catalog_cache.generations([Product]), generations)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(catalog_cache.generations([Product])[0], generations[0])
+
+        self.assertEqual(check_catalog_cache(None), [])
+        with self.settings(CATALOG_CACHE_REQUIRE_SHARED=True):
+            self.assertEqual([error.id for error in check_catalog_cache(None)], ['shopping.E001'])
+
+    def test_product_list_not_modified(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.product.price = 90
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_list_modified_by_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            newest = Product.objects.create(category=self.category, info='', price=5, stock=1)
+        last_modified = self.client.get(self.url)['Last-Modified']
+
+        later = time.time_ns() + 5 * 10 ** 9
+        with mock.patch('shopping.cache.time.time_ns', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            newest.delete()
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product['id'] for product in response.data['results']], [self.product.id])
+
+    def test_in_stock_list_follows_stock(self):
+        url = self.url + '?in_stock=true'
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+        user = User.objects.create_user(email='stock@example.com', password='test', fullname='stock')
+        cart = Cart.objects.create(user=user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            add_to_cart(cart.id, self.product.id, 5)
+        self.assertEqual(self.client.get(url).data['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            restore_stock({self.product.id: 2})
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock({self.product.id: 2})
+        self.assertEqual(self.client.get(url).data['results'], [])
+
+    def test_product_list_filters_and_facets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hats = Category.objects.create(title='hats')
+            cap = Product.objects.create(category=hats, info='', price=20, stock=2)
+            Product.objects.create(category=hats, info='', price=300, stock=0)
+            cheap_shoe = Product.objects.create(category=self.category, info='', price=40, stock=1)
+
+        response = self.client.get(self.url, {'category': self.category.id, 'max_price': 50})
+        self.assertEqual([product['id'] for product in response.data['results']], [cheap_shoe.id])
+
+        response = self.client.get(self.url, {
+            'in_stock': 'true', 'ordering': 'price', 'min_price': 10, 'facets': 'true'})
+        self.assertEqual([product['id'] for product in response.data['results']],
+                         [cap.id, cheap_shoe.id, self.product.id])
+        self.assertEqual(response.data['facets']['categories'], [
+            {'id': self.category.id, 'title': 'shoes', 'count': 2},
+            {'id': hats.id, 'title': 'hats', 'count': 1},
+        ])
+        self.assertEqual([bucket['count'] for bucket in response.data['facets']['price']], [2, 0, 1, 0, 0])
+
+        response = self.client.get(self.url, {'min_price': 'cheap'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_product_list_streams_every_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for price in (10, 20, 30, 40):
+                Product.objects.create(category=self.category, info='', price=price, stock=1)
+
+        with self.settings(STREAM_CHUNK_SIZE=2):
+            response = self.client.get(self.url, {'stream': 'true', 'max_price': 35})
+            chunks = list(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(chunks), 3)
+        expected = ProductListSerializer(
+            Product.objects.filter(price__lte=35).order_by('id'), many=True,
+            context={'request': response.wsgi_request}).data
+        self.assertEqual(json.loads(b''.join(chunks)), json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+        response = self.client.get(reverse('reviews'), {'stream': '1'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+    def test_product_list_invalid_cursor(self):
+        response = self.client.get(self.url + '?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncCatalogViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = AsyncRequestFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(title="shoes")
+            for price in (10, 20, 30):
+                Product.objects.create(category=self.category, info='<p>shoes</p>', price=price, stock=1)
+
+    async def get(self, view, path, **extra):
+        response = await view.as_view()(self.factory.get(path, **extra))
+        return response, json.loads(response.content) if response.content else None
+
+    async def test_product_list_matches_sync_view(self):
+        path = reverse('products') + '?ordering=-price&page_size=2&facets=true'
+        expected = json.loads((await sync_to_async(self.client.get)(path)).content)
+        await sync_to_async(catalog_cache.bump)(Product)
+
+        response, data = await self.get(AsyncProductListView, path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(data, expected)
+
+        response, page = await self.get(AsyncProductListView, data['next'].replace('http://testserver', ''))
+        self.assertEqual([product['price'] for product in page['results']], ['10.00'])
+
+    async def test_not_modified_and_errors(self):
+        path = reverse('category')
+        response, data = await self.get(AsyncCategoryListView, path)
+        self.assertEqual(data, [{'id': self.category.id, 'title': 'shoes'}])
+        response, _ = await self.get(AsyncCategoryListView, path, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response, data = await self.get(AsyncProductListView, reverse('products') + '?min_price=cheap')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('min_price', data)
+        response, data = await self.get(AsyncProductListView, reverse('products') + '?cursor=garbage')
+        self.assertEqual((response.status_code, data), (status.HTTP_404_NOT_FOUND, {'detail': 'Invalid cursor'}))
+
+    async def test_product_list_streams(self):
+        response = await AsyncProductListView.as_view()(self.factory.get(reverse('products') + '?stream=true&min_price=15'))
+        data = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([product['price'] for product in data], ['20.00', '30.00'])
+
+
+class ProductSearchViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes = Category.objects.create(title='shoes')
+            self.hats = Category.objects.create(title='hats')
+            self.boot = Product.objects.create(category=self.shoes, info='<p>leather <b>boots</b></p>', price=80, stock=3)
+            self.sneaker = Product.objects.create(category=self.shoes, info='<p>running sneakers</p>', price=60, stock=3)
+            self.cap = Product.objects.create(category=self.hats, info='<p>leather cap</p>', price=20, stock=3)
+        self.url = reverse('product-search')
+
+    def test_search_ranks_matches(self):
+        response = self.client.get(self.url, {'q': 'leather'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({product['id'] for product in response.data['results']}, {self.boot.id, self.cap.id})
+
+        response = self.client.get(self.url, {'q': 'leather boots'})
+        self.assertEqual([product['id'] for product in response.data['results']], [self.boot.id])
+
+    def test_reindex_command(self):
+        Product.objects.update(search_vector=None)
+        call_command('reindex_products', chunk_size=2, stdout=StringIO())
+        response = self.client.get(self.url, {'q': 'sneakers'})
+        self.assertEqual([product['id'] for product in response.data['results']], [self.sneaker.id])
+
+    def test_migration_backfills_search_vectors(self):
+        Product.objects.update(search_vector=None)
+        migration = importlib.import_module('shopping.migrations.0021_backfill_product_search_vector')
+        migration.fill_search_vectors(django_apps, mock.Mock(connection=connection), batch_size=2)
+        self.assertFalse(Product.objects.filter(search_vector__isnull=True).exists())
+        response = self.client.get(self.url, {'q': 'sneakers'})
+        self.assertEqual([product['id'] for product in response.data['results']], [self.sneaker.id])
+
+    def test_search_follows_category_rename(self):
+        self.hats.title = 'headwear'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hats.save()
+        response = self.client.get(self.url, {'q': 'headwear'})
+        self.assertEqual([product['id'] for product in response.data['results']], [self.cap.id])
+
+    def test_search_pages(self):
+        response = self.client.get(self.url, {'q': 'leather OR shoes', 'page_size': 1})
+        seen = [product['id'] for product in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [product['id'] for product in response.data['results']]
+        self.assertEqual(sorted(seen), sorted([self.boot.id, self.sneaker.id, self.cap.id]))
+
+    def test_search_requires_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class CartItemViewSetTest(APITestCase):
     def setUp(self):
@@ -79,6 +401,25 @@ class CartItemViewSetTest(APITestCase):
         expected_data = CartListSerializer(self.cart).data
         self.assertEqual(response.data, expected_data)
 
+    def test_cart_items_list_queries(self):
+        for price in (10, 20, 30):
+            product = Product.objects.create(category=self.category, info='', price=price, stock=5)
+            CartItem.objects.create(product=product, cart=self.cart, quantity=3)
+
+        with self.assertNumQueries(3):  # token lookup, cart with total, items with products
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_price'], Decimal('201.98') + 180)
+        self.assertEqual([item['subtotal_price'] for item in response.data['cart_items']],
+                         [Decimal('201.98'), 30, 60, 90])
+
+    def test_cart_items_list_without_cart(self):
+        self.cart.delete()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'cart_items': [], 'total_price': 0})
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
     def test_create_cart_item(self):
         data = {
             'product': self.new_product.id,
@@ -92,6 +433,21 @@ class CartItemViewSetTest(APITestCase):
         expected_data = CartItemCreateSerializer(cart_item).data
         self.assertEqual(response.data, expected_data)
 
+    def test_create_existing_cart_item_adds_quantity(self):
+        response = self.client.post(self.list_url, {'product': self.product.id, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'product': self.product.id, 'quantity': 5})
+        self.assertEqual(CartItem.objects.filter(cart=self.cart, product=self.product).count(), 1)
+
+        response = self.client.post(self.list_url, {'product': self.product.id, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.cart_item.refresh_from_db()
+        self.assertEqual((self.cart_item.quantity, self.cart_item.reserved_quantity), (5, 3))
+
+    def test_create_cart_item_unknown_product(self):
+        response = self.client.post(self.list_url, {'product': 999999, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_not_enough_stock(self):
         data = {
             'product': self.new_product.id,
@@ -120,6 +476,86 @@ class CartItemViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('Not enough stock', str(response.data))
 
+    def test_create_cart_item_reserves_stock(self):
+        response = self.client.post(self.list_url, {'product': self.new_product.id, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 7)
+
+        cart_item = CartItem.objects.get(cart=self.cart, product=self.new_product)
+        response = self.client.patch(self.detail_url(cart_item.id), {'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 9)
+
+        self.client.delete(self.detail_url(cart_item.id))
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 10)
+
+    def test_expired_reservations_are_released(self):
+        self.client.post(self.list_url, {'product': self.new_product.id, 'quantity': 4})
+        CartItem.objects.filter(product=self.new_product).update(
+            reserved_until=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(release_expired(), 1)
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 10)
+        cart_item = CartItem.objects.get(product=self.new_product)
+        self.assertEqual((cart_item.quantity, cart_item.reserved_quantity), (4, 0))
+
+    def test_batch_operations(self):
+        third = Product.objects.create(category=self.category, info='', price=5, stock=3)
+        response = self.client.post(reverse('cart-item-batch'), {'operations': [
+            {'op': 'add', 'product': self.new_product.id, 'quantity': 2},
+            {'op': 'add', 'product': self.new_product.id, 'quantity': 1},
+            {'op': 'set', 'product': third.id, 'quantity': 3},
+            {'op': 'remove', 'product': self.product.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = {item['product']['id']: item['quantity'] for item in response.data['cart_items']}
+        self.assertEqual(lines, {self.new_product.id: 3, third.id: 3})
+        self.assertEqual(response.data['total_price'], Decimal('151.50') + 15)
+        self.assertEqual(list(Product.objects.filter(id__in=[self.new_product.id, third.id])
+                              .order_by('id').values_list('stock', flat=True)), [7, 0])
+
+    def test_batch_operations_are_all_or_nothing(self):
+        response = self.client.post(reverse('cart-item-batch'), {'operations': [
+            {'op': 'set', 'product': self.new_product.id, 'quantity': 2},
+            {'op': 'set', 'product': self.product.id, 'quantity': 50},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['products'], [self.product.id])
+        self.assertFalse(CartItem.objects.filter(product=self.new_product).exists())
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 10)
+
+    def test_out_of_range_and_malformed_quantities(self):
+        huge = 2 ** 40
+        for data in ({'product': self.new_product.id, 'quantity': huge},
+                     {'product': huge ** 2, 'quantity': 1},
+                     {'product': [self.new_product.id], 'quantity': 1},
+                     {'product': self.new_product.id, 'quantity': {'n': 1}}):
+            response = self.client.post(self.list_url, data, format='json')
+            self.assertIn(response.status_code, (status.HTTP_400_BAD_REQUEST, status.HTTP_404_NOT_FOUND), data)
+        response = self.client.patch(self.detail_url(self.cart_item.id), {'quantity': huge}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(self.detail_url(self.cart_item.id), {'quantity': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_rejects_out_of_range_and_malformed_operations(self):
+        huge = 2 ** 40
+        for operations in ([{'op': 'set', 'product': self.new_product.id, 'quantity': huge}],
+                           [{'op': 'add', 'product': huge ** 2, 'quantity': 1}],
+                           [{'op': ['add'], 'product': self.new_product.id, 'quantity': 1}],
+                           [{'op': 'add', 'product': {'id': 1}, 'quantity': 1}],
+                           [['add', self.new_product.id, 1]],
+                           [{'op': 'add', 'product': self.new_product.id, 'quantity': 2 ** 31 - 1}] * 2,
+                           [{'op': 'add', 'product': self.product.id, 'quantity': 2 ** 31 - 1}]):
+            response = self.client.post(reverse('cart-item-batch'), {'operations': operations}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, operations)
+        self.new_product.refresh_from_db()
+        self.assertEqual(self.new_product.stock, 10)
+
     def test_delete_cart_item(self):
         url = self.detail_url(self.cart_item.id)
         response = self.client.delete(url)
@@ -169,9 +605,309 @@ class OrderViewTest(APITestCase):
         order_product = OrderProduct.objects.filter(order=order, product=self.product).first()
         self.assertIsNotNone(order_product)
         self.assertEqual(order_product.quantity, self.cart_item.quantity)
-        
 
+    def checkout_queries(self):
+        data = {
+            'address': '123 Street',
+            'zip_code': '122ab',
+            'phone_number': '+994552224477'
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return len(queries)
+
+    def test_order_create_constant_queries(self):
+        self.client.get(reverse('orders'))  # warm the auth user cache
+        single_line = self.checkout_queries()
+
+        for price in (10, 20, 30):
+            product = Product.objects.create(category=self.category, info='', price=price, stock=20)
+            CartItem.objects.create(product=product, cart=self.cart, quantity=2)
+        CartItem.objects.create(product=self.product, cart=self.cart, quantity=1)
+        self.assertEqual(self.checkout_queries(), single_line)
+
+        self.assertEqual(Job.objects.filter(name='shopping.record_order_sales').count(), 2)
+        self.assertEqual(jobs.work(), 2)
+        self.assertEqual(exact_sales_numbers([self.product.id]), {self.product.id: 2 + 5 + 1})
+        before = self.product.updated_at
+        with mock.patch.object(catalog_cache, 'bump_on_commit') as bump:
+            counters.fold()
+        bump.assert_called_once_with(Product)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sales_number, 2 + 5 + 1)
+        self.assertGreater(self.product.updated_at, before)
+        self.assertFalse(SalesCounterShard.objects.exists())
+        self.assertEqual(OrderProduct.objects.filter(order__user=self.user).count(), 5)
+
+    def test_order_updates_bestsellers(self):
+        runner_up = Product.objects.create(category=self.category, info='', price=10, stock=20, sales_number=6)
+        call_command('rebuild_bestsellers', stdout=StringIO())
+        response = self.client.get(reverse('bestsellers'))
+        self.assertEqual([entry['product']['id'] for entry in response.data], [runner_up.id, self.product.id])
+
+        self.checkout_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.work()
+
+        response = self.client.get(reverse('bestsellers'), {'category': self.category.id})
+        self.assertEqual([(entry['product']['id'], entry['units']) for entry in response.data],
+                         [(self.product.id, 7), (runner_up.id, 6)])
+        response = self.client.get(reverse('bestsellers'), {'window': '7d'})
+        self.assertEqual([(entry['product']['id'], entry['units']) for entry in response.data],
+                         [(self.product.id, 5)])
+
+    def test_bestsellers_count_every_sale_before_fold(self):
+        call_command('rebuild_bestsellers', stdout=StringIO())
+        self.checkout_queries()
+        CartItem.objects.create(product=self.product, cart=self.cart, quantity=1)
+        self.checkout_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(jobs.work(), 2)
+
+        response = self.client.get(reverse('bestsellers'))
+        self.assertEqual([(entry['product']['id'], entry['units']) for entry in response.data],
+                         [(self.product.id, 2 + 5 + 1)])
+
+    def test_bestseller_boards_expire_despite_sales(self):
+        call_command('rebuild_bestsellers', stdout=StringIO())
+        expires = leaderboard._cache().get(leaderboard.board_key('all'))['expires']
+
+        with mock.patch('shopping.leaderboard.time.time', return_value=expires - 5):
+            leaderboard.record_sales([(self.product.id, self.category.id, 1, 3)])
+        board = leaderboard._cache().get(leaderboard.board_key('all'))
+        self.assertEqual(board, {'expires': expires, 'entries': [[self.product.id, 3]]})
+        with mock.patch('shopping.leaderboard.time.time', return_value=expires - 5), \
+                mock.patch.object(leaderboard._cache(), 'set') as set_board:
+            leaderboard.record_sales([(self.product.id, self.category.id, 1, 4)])
+        set_board.assert_any_call(leaderboard.board_key('all'), mock.ANY, timeout=5)
+
+    def test_order_history(self):
+        self.checkout_queries()
+        CartItem.objects.create(product=self.product, cart=self.cart, quantity=1)
+        self.checkout_queries()
+        Product.objects.filter(id=self.product.id).update(price=999)
+
+        with self.assertNumQueries(2):  # orders, lines; the user comes from the auth cache
+            response = self.client.get(reverse('orders'), {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['products'], [
+            {'product': self.product.id, 'quantity': 1, 'unit_price': '200.00', 'subtotal_price': Decimal('200.00')},
+        ])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['products'][0]['quantity'], 5)
+        self.assertIsNone(response.data['next'])
+
+    def test_export_orders(self):
+        self.checkout_queries()
+        CartItem.objects.create(product=self.product, cart=self.cart, quantity=1)
+        self.checkout_queries()
+        Order.objects.filter(id=Order.objects.latest('id').id).update(status=Order.OrderStatus.delivered)
+
+        out = StringIO()
+        with self.assertNumQueries(2):  # orders with users, then one lines query for the chunk
+            call_command('export_orders', stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(row['email'], row['quantity'], row['unit_price']) for row in rows],
+                         [('lily@lay.com', '5', '200.00'), ('lily@lay.com', '1', '200.00')])
+
+        out = StringIO()
+        call_command('export_orders', '--format=ndjson', '--status=Delivered', '--since=2000-01-01', stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['lines'][0]['quantity'] for record in records], [1])
+
+        admin = User.objects.create_superuser(email='admin@lay.com', password='admin123')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:shopping_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [order.id for order in Order.objects.all()]})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+    def admin_edit_product(self, **changes):
+        response = self.client.get(reverse('admin:shopping_product_change', args=[self.product.id]))
+        self.assertContains(response, f'name="initial-stock" value="{self.product.stock}"')
+        form = response.context['adminform'].form
+        data = {name: form[name].value() or '' for name in form.fields}
+        data['initial-stock'] = form['stock'].value()
+        data.update(changes)
+        return data
+
+    def test_admin_stock_edit_keeps_concurrent_reservations(self):
+        self.client.force_login(User.objects.create_superuser(email='admin@lay.com', password='admin123'))
+        url = reverse('admin:shopping_product_change', args=[self.product.id])
+        data = self.admin_edit_product(price='250.00')
+        take_stock({self.product.id: 3})  # a reservation while the form is open
+        self.assertEqual(self.client.post(url, data).status_code, status.HTTP_302_FOUND)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.stock), (Decimal('250.00'), 17))
+
+        self.assertNotIn('sales_number', self.admin_edit_product())
+        data = self.admin_edit_product(stock=27)
+        restore_stock({self.product.id: 1})
+        self.client.post(url, data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 18 + 10)
+
+    def test_admin_changelists_do_not_query_per_row(self):
+        admin = User.objects.create_superuser(email='admin@lay.com', password='admin123')
+        self.client.force_login(admin)
+
+        def changelist_queries(name):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:shopping_{name}_changelist'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        self.checkout_queries()
+        before = {name: changelist_queries(name) for name in ('order', 'orderproduct', 'cartitem', 'product')}
+        for index in range(3):
+            buyer = User.objects.create_user(email=f'buyer{index}@lay.com', password='x')
+            order = Order.objects.create(user=buyer, total_price=1, address='a', zip_code='1', phone_number=1)
+            OrderProduct.objects.create(order=order, product=self.product, quantity=1)
+            product = Product.objects.create(category=Category.objects.create(title=f'c{index}'), info='', price=1, stock=1)
+            CartItem.objects.create(cart=Cart.objects.create(user=buyer), product=product, quantity=1)
+        self.assertEqual({name: changelist_queries(name) for name in before}, before)
+
+    def test_daily_sales_rollups(self):
+        self.checkout_queries()
+        CartItem.objects.create(product=self.product, cart=self.cart, quantity=1)
+        self.checkout_queries()
+        jobs.work()
+        today = timezone.localdate()
+
+        def product_rollup():
+            return DailyProductSales.objects.values_list('day', 'product_id', 'units', 'revenue', 'orders').get()
+
+        self.assertEqual(product_rollup(), (today, self.product.id, 6, Decimal('1200.00'), 2))
+        jobs.enqueue('shopping.record_order_sales', {'order_id': Order.objects.earliest('id').id})
+        jobs.work()
+        self.assertEqual(product_rollup()[2:], (6, Decimal('1200.00'), 2))
+
+        order = Order.objects.earliest('id')
+        order.status = Order.OrderStatus.canceled
+        order.save()
+        self.assertEqual(product_rollup()[2:], (1, Decimal('200.00'), 1))
+        self.assertEqual(DailyCategorySales.objects.values_list('category_id', 'units').get(),
+                         (self.category.id, 1))
+
+        DailyProductSales.objects.update(units=999)
+        Order.objects.update(in_rollups=False)  # e.g. orders placed before rollups existed
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(product_rollup()[2:], (1, Decimal('200.00'), 1))
+        self.assertEqual(list(Order.objects.order_by('id').values_list('in_rollups', flat=True)), [False, True])
+
+        Order.objects.latest('id').delete()
+        self.assertEqual(product_rollup()[2:], (0, Decimal('0.00'), 0))
+        call_command('rebuild_sales_rollups', '--all', stdout=StringIO())
+        self.assertFalse(DailyProductSales.objects.exists())
+
+    def test_sales_analytics(self):
+        self.checkout_queries()
+        jobs.work()
+        url = reverse('sales-analytics')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(User.objects.create_superuser(email='admin@lay.com', password='admin123'))
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'group': 'category'})
+        self.assertEqual(response.data['results'], [
+            {'category': self.category.id, 'units': 5, 'revenue': Decimal('1000.00'), 'orders': 1}])
+        response = self.client.get(url, {'product': self.product.id})
+        self.assertEqual(response.data['results'], [
+            {'day': timezone.localdate(), 'units': 5, 'revenue': Decimal('1000.00'), 'orders': 1}])
+        self.assertIsNone(self.client.get(url).data['results'][0]['orders'])
+
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.assertEqual(self.client.get(url, {'until': yesterday}).data['results'], [])
+        response = self.client.get(url, {'group': 'product', 'category': self.category.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_order_prices(self):
+        self.checkout_queries()
+        OrderProduct.objects.update(unit_price=None)
+        call_command('backfill_order_prices', stdout=StringIO())
+        self.assertEqual(OrderProduct.objects.get().unit_price, self.product.price)
 
+    def test_order_create_empty_cart(self):
+        self.cart_item.delete()
+        data = {
+            'address': '123 Street',
+            'zip_code': '122ab',
+            'phone_number': '+994552224477'
+        }
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
 
 
+class StockStressTest(TransactionTestCase):
+    ''' Many buyers race for one hot product; nobody may buy more than the stock. '''
+    buyers = 40
+    stock = 15
 
+    def setUp(self):
+        category = Category.objects.create(title='shoes')
+        self.product = Product.objects.create(category=category, info='', price=10, stock=self.stock)
+        self.tokens = [
+            Token.objects.create(user=User.objects.create(email=f'buyer{i}@lay.com')).key
+            for i in range(self.buyers)
+        ]
+
+    def buy(self, token, results):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        try:
+            added = client.post(reverse('cart-item-list'), {'product': self.product.id, 'quantity': 1})
+            if added.status_code == status.HTTP_201_CREATED:
+                response = client.post(reverse('checkout'), {
+                    'address': '123 Street', 'zip_code': '122ab', 'phone_number': '+994552224477'})
+                results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_no_oversell_under_concurrency(self):
+        results = []
+        threads = [threading.Thread(target=self.buy, args=(token, results)) for token in self.tokens]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(results.count(status.HTTP_201_CREATED), self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(sum(OrderProduct.objects.values_list('quantity', flat=True)), self.stock)
+        sys.stderr.write(f'\n{self.stock} checkouts for {self.buyers} buyers in {elapsed:.2f}s '
+                         f'({self.stock / elapsed:.1f} checkouts/sec)\n')
+
+
+class BestSellerConcurrencyTest(TransactionTestCase):
+    ''' Workers folding sales into the same boards at once must not lose any. '''
+    writers = 8
+
+    def setUp(self):
+        self.category = Category.objects.create(title='shoes')
+        self.product = Product.objects.create(category=self.category, info='', price=10, stock=20)
+        leaderboard.rebuild()
+
+    def record(self):
+        try:
+            leaderboard.record_sales([(self.product.id, self.category.id, 1, None)])
+        finally:
+            connection.close()
+
+    def test_concurrent_sales_all_count(self):
+        threads = [threading.Thread(target=self.record) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(leaderboard.top('7d', self.category.id), [[self.product.id, self.writers]])
+
+    def test_unknown_category_is_not_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(leaderboard.top('all', self.category.id + 1), [])
+        self.assertIsNone(leaderboard._cache().get(leaderboard.board_key('all', self.category.id + 1)))
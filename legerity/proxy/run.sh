@@ -2,6 +2,11 @@
 
 set -e
 
-envsubst < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+# Only substitute our own variables; the ASGI template also uses nginx's $host etc.
+template=/etc/nginx/default.conf.tpl
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    template=/etc/nginx/asgi.conf.tpl
+fi
+envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT}' < $template > /etc/nginx/conf.d/default.conf
 
 nginx -g 'daemon off;'
\ No newline at end of file
@@ -0,0 +1,91 @@
+'''
+Hold many concurrent HTTP/1.1 connections against one URL and report throughput.
+
+Only uses the standard library so it runs anywhere Python does:
+
+    python scripts/loadtest.py http://localhost/shopping/products/ --connections 500 --duration 60
+
+Every connection sends a request, reads the whole response and immediately sends the
+next one over the same socket. The summary is printed as JSON.
+'''
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(url, deadline, results):
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    request = f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: application/json\r\n\r\n'.encode()
+    writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            started = time.monotonic()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            results['latencies'].append(time.monotonic() - started)
+            results['statuses'][status] = results['statuses'].get(status, 0) + 1
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            results['errors'] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+async def main(url, connections, duration):
+    results = {'latencies': [], 'statuses': {}, 'errors': 0}
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*[client(url, deadline, results) for _ in range(connections)])
+    latencies = sorted(results['latencies'])
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+    return {
+        'url': url,
+        'connections': connections,
+        'duration': duration,
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'errors': results['errors'],
+        'statuses': results['statuses'],
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+            'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url')
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args.url, args.connections, args.duration)), indent=2))
@@ -6,4 +6,8 @@ python manage.py wait_for_db
 python manage.py collectstatic --noinput
 python manage.py migrate
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    exec uvicorn app.asgi:application --host 0.0.0.0 --port 9000 --workers ${WEB_WORKERS:-4}
+fi
+
+uwsgi --socket :9000 --workers ${WEB_WORKERS:-4} --master --enable-threads --module app.wsgi
\ No newline at end of file